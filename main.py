@@ -13,11 +13,12 @@ from telegram.ext import ApplicationBuilder, ContextTypes
 from src.auth.oauth import OAuthManager
 from src.bot.auth_handlers import _send_auth_success_message
 from src.bot.bot import TelegramBot
+from src.bot.context import CONTEXT_TYPES
 from src.db.database import init_db
 from src.server.oauth_server import OAuthServer
 from src.sheets.client import GoogleSheetsClient
 from src.sheets.operations import SheetsOperations
-from src.utils.config import Config
+from src.utils.config import get_config
 from src.utils.logger import setup_logging
 
 
@@ -88,7 +89,7 @@ def main() -> None:
     """
 
     try:
-        config = Config()
+        config = get_config()
         log_dir = Path(__file__).parent / "logs"
         log_dir.mkdir(exist_ok=True)
         setup_logging(log_dir / "app.log", level=config.log_level)
@@ -105,11 +106,11 @@ def main() -> None:
         sheets_client = GoogleSheetsClient(oauth_manager)
         logger.info("Google Sheets client initialized")
 
-        application = ApplicationBuilder().token(config.telegram_token).build()
+        application = ApplicationBuilder().token(config.telegram_token).context_types(CONTEXT_TYPES).build()
         logger.info("Telegram Application created")
 
-        application.bot_data["oauth_manager"] = oauth_manager
-        application.bot_data["sheets_client"] = sheets_client
+        application.bot_data.oauth_manager = oauth_manager
+        application.bot_data.sheets_client = sheets_client
 
         callback_with_context = functools.partial(
             main_oauth_callback_handler,
@@ -133,7 +134,7 @@ def main() -> None:
 
         bot = TelegramBot(config.telegram_token, sheets_operations, oauth_manager)
 
-        application.bot_data["sheets_operations"] = sheets_operations
+        application.bot_data.sheets_operations = sheets_operations
 
         bot.setup(existing_application=application)
         logger.info("Telegram bot configured, starting...")
@@ -149,6 +150,8 @@ def main() -> None:
                 logger.info("OAuth server stopped")
         except Exception as e:
             logger.error(f"Error stopping the OAuth server: {e}")
+        if "sheets_client" in locals():
+            sheets_client.close()
 
 
 if __name__ == "__main__":
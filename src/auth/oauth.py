@@ -2,6 +2,8 @@ import datetime
 import json
 import os
 import secrets
+import threading
+import time
 from typing import Any
 
 import requests
@@ -11,11 +13,11 @@ from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from loguru import logger
-from sqlalchemy import delete, select
+from sqlalchemy import delete, func
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from ..db.database import AuthToken, SessionLocal, User
+from ..db.database import AuthToken, ScopedSession, SessionLocal, User, upsert_insert
 
 
 class OAuthManager:
@@ -34,6 +36,11 @@ class OAuthManager:
         "https://www.googleapis.com/auth/spreadsheets",
     ]
     REVOCATION_ENDPOINT = "https://oauth2.googleapis.com/revoke"
+    # Pending OAuth states are single-use and expire if the user never completes the flow
+    STATE_TTL_SECONDS = 600
+    MAX_PENDING_STATES = 1024
+    # How long an is_authenticated result is reused before loading the token again
+    AUTH_STATUS_TTL_SECONDS = 30
 
     def __init__(
         self,
@@ -52,7 +59,13 @@ class OAuthManager:
         self.client_secrets_file = client_secrets_file
         self.redirect_uri = redirect_uri
         self.fernet = Fernet(encryption_key)
-        self._pending_states: dict[str, str] = {}
+        # state -> (user_id, creation time from time.monotonic())
+        self._pending_states: dict[str, tuple[str, float]] = {}
+        # user_id -> (is_authenticated result, time.monotonic() when checked)
+        self._auth_status: dict[str, tuple[bool, float]] = {}
+        # user_id -> number of invalidations, so a check that overlaps one doesn't cache its stale result
+        self._auth_generation: dict[str, int] = {}
+        self._auth_status_lock = threading.Lock()
 
         if not os.path.exists(self.client_secrets_file):
             logger.error(f"OAuth client secrets file not found: {self.client_secrets_file}")
@@ -72,6 +85,17 @@ class OAuthManager:
             logger.error("Client secret not found in client secrets file.")
             raise ValueError("Client secret missing in client secrets configuration.")
 
+    def _prune_pending_states(self) -> None:
+        """Drops expired states and caps the pending map so abandoned flows don't accumulate."""
+        now = time.monotonic()
+        for state, (_, created_at) in list(self._pending_states.items()):
+            if now - created_at > self.STATE_TTL_SECONDS:
+                self._pending_states.pop(state, None)
+
+        # Dicts keep insertion order, so the first keys are the oldest states
+        while len(self._pending_states) >= self.MAX_PENDING_STATES:
+            self._pending_states.pop(next(iter(self._pending_states)), None)
+
     def generate_auth_url(self, user_id: str) -> tuple[str, str]:
         """
         Generates a secure authorization URL for a user to protect against CSRF attacks.
@@ -91,7 +115,8 @@ class OAuthManager:
 
             # Generate a cryptographically secure state parameter to prevent CSRF attacks
             state = secrets.token_urlsafe(32)
-            self._pending_states[state] = user_id
+            self._prune_pending_states()
+            self._pending_states[state] = (user_id, time.monotonic())
 
             auth_url, _ = flow.authorization_url(
                 access_type="offline",
@@ -109,27 +134,22 @@ class OAuthManager:
         except Exception as e:
             logger.error(f"Error generating authorization URL for user {user_id}: {e}")
             # Clean up potentially stored state if URL generation failed
-            if "state" in locals() and state in self._pending_states:
-                del self._pending_states[state]
+            if "state" in locals():
+                self._pending_states.pop(state, None)
             raise
 
     def _upsert_user(self, db: Session, user_id: str) -> None:
-        """Creates or updates a user entry to ensure database integrity before token storage."""
+        """Creates a user entry if missing to ensure database integrity before token storage."""
         try:
-            stmt = select(User).where(User.user_id == user_id)
-            existing_user = db.scalars(stmt).first()
-
-            if existing_user:
-                logger.debug(f"User {user_id} already exists in the database.")
-            else:
-                logger.info(f"User {user_id} not found, creating new entry.")
-                new_user = User(user_id=user_id)
-                db.add(new_user)
-                db.flush()
+            insert = upsert_insert(db)
+            stmt = insert(User).values(user_id=user_id).on_conflict_do_nothing(index_elements=[User.user_id])
+            result = db.execute(stmt)
+            if result.rowcount:
                 logger.info(f"User {user_id} created successfully.")
+            else:
+                logger.debug(f"User {user_id} already exists in the database.")
         except Exception as e:
             logger.error(f"Error upserting user {user_id}: {e}")
-            db.rollback()
             raise
 
     def exchange_code(self, state: str, code: str) -> str | None:
@@ -148,13 +168,14 @@ class OAuthManager:
             ValueError: If the state is invalid or not found.
             Exception: For errors during the token exchange process or DB operations.
         """
-        user_id = self._pending_states.pop(state, None)
+        pending = self._pending_states.pop(state, None)
 
-        if not user_id:
+        if not pending or time.monotonic() - pending[1] > self.STATE_TTL_SECONDS:
             logger.error(f"Invalid or expired state received: {state}")
             raise ValueError("Invalid or expired OAuth state.")
 
-        db: Session | None = None
+        user_id = pending[0]
+
         try:
             flow = Flow.from_client_secrets_file(self.client_secrets_file, scopes=self.SCOPES, redirect_uri=self.redirect_uri)
             flow.oauth2session.state = state
@@ -171,22 +192,43 @@ class OAuthManager:
                 "expiry": credentials.expiry.isoformat() if credentials.expiry else None,
             }
 
-            db = SessionLocal()
-            self._upsert_user(db, user_id)
-            self.save_token(user_id, token_data, db_session=db)
-            db.commit()
+            # User and token rows are written in a single transaction (one commit).
+            # This runs on the OAuth server thread, which reuses its thread-local session.
+            db = ScopedSession()
+            with db.begin():
+                self._upsert_user(db, user_id)
+                self.save_token(user_id, token_data, db_session=db)
+            self._invalidate_auth_status(user_id)
 
             logger.info(f"Authorization code exchanged successfully for user {user_id}")
             return user_id
 
         except Exception as e:
             logger.error(f"Error exchanging code for user {user_id} (state: {state}): {e}")
-            if db:
-                db.rollback()
             raise
-        finally:
-            if db:
-                db.close()
+
+    @staticmethod
+    def _utcnow() -> datetime.datetime:
+        """Returns the current UTC time as a naive datetime, as google-auth expects."""
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    @staticmethod
+    def _parse_expiry(expiry: str | None) -> datetime.datetime | None:
+        """
+        Parses a stored ISO expiry into the naive UTC datetime used by Credentials.
+
+        Args:
+            expiry: ISO 8601 timestamp saved with the token, or None.
+
+        Returns:
+            Naive UTC datetime, or None if no expiry was stored.
+        """
+        if not expiry:
+            return None
+        parsed = datetime.datetime.fromisoformat(expiry)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return parsed
 
     def get_credentials(self, user_id: str) -> Credentials | None:
         """
@@ -201,7 +243,7 @@ class OAuthManager:
         """
         token_data = self.load_token(user_id)
         if not token_data:
-            logger.debug(f"No token found in database for user {user_id}")
+            logger.debug("No token found in database for user {}", user_id)
             return None
 
         try:
@@ -212,12 +254,13 @@ class OAuthManager:
                 client_id=token_data.get("client_id"),
                 client_secret=self._get_client_secret(),
                 scopes=token_data.get("scopes"),
+                expiry=self._parse_expiry(token_data.get("expiry")),
             )
 
             # Check if token will expire soon (within 5 minutes) or is already expired
             should_refresh = False
             if credentials.expiry:
-                time_until_expiry = credentials.expiry - datetime.datetime.now(datetime.timezone.utc)
+                time_until_expiry = credentials.expiry - self._utcnow()
                 # If token expires within 5 minutes or is already expired
                 if time_until_expiry.total_seconds() < 300:
                     should_refresh = True
@@ -344,6 +387,8 @@ class OAuthManager:
         finally:
             if db:
                 db.close()
+            # After the delete, so a concurrent check can't cache the old token as valid
+            self._invalidate_auth_status(user_id)
 
         if not deleted_local and not revocation_success:
             logger.warning(f"Token revocation failed both with Google and locally for user {user_id}.")
@@ -362,6 +407,7 @@ class OAuthManager:
             db_session: Optional existing SQLAlchemy session to use.
         """
         db: Session | None = None
+        manage_session = False
         try:
             if not token_data.get("refresh_token"):
                 logger.warning(f"Attempted to save token for user {user_id} without a refresh token. Aborting save.")
@@ -387,25 +433,17 @@ class OAuthManager:
                 db = SessionLocal()
                 manage_session = True
 
-            existing_token = db.get(AuthToken, user_id)
-
-            if existing_token:
-                existing_token.encrypted_token = encrypted_token_bytes
-                existing_token.token_expiry = token_expiry_dt
-                logger.debug(f"Updating existing token in database for user {user_id}")
-            else:
-                new_token = AuthToken(
-                    user_id=user_id,
-                    encrypted_token=encrypted_token_bytes,
-                    token_expiry=token_expiry_dt,
-                )
-                db.add(new_token)
-                logger.debug(f"Inserting new token into database for user {user_id}")
+            insert = upsert_insert(db)
+            stmt = insert(AuthToken).values(user_id=user_id, encrypted_token=encrypted_token_bytes, token_expiry=token_expiry_dt)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[AuthToken.user_id],
+                set_={"encrypted_token": encrypted_token_bytes, "token_expiry": token_expiry_dt, "updated_at": func.now()},
+            )
+            db.execute(stmt)
 
             if manage_session:
                 db.commit()
-            else:
-                db.flush()
+                self._invalidate_auth_status(user_id)
 
             logger.info(f"Encrypted token saved to database for user {user_id}")
 
@@ -448,7 +486,7 @@ class OAuthManager:
 
             decrypted_token_json = self.fernet.decrypt(token_record.encrypted_token)
             token_data = json.loads(decrypted_token_json.decode("utf-8"))
-            logger.debug(f"Encrypted token loaded and decrypted from database for user {user_id}")
+            logger.debug("Encrypted token loaded and decrypted from database for user {}", user_id)
             return token_data
 
         except InvalidToken:
@@ -473,6 +511,7 @@ class OAuthManager:
             stmt = delete(AuthToken).where(AuthToken.user_id == user_id)
             db.execute(stmt)
             db.commit()
+            self._invalidate_auth_status(user_id)
             logger.warning(f"Deleted potentially corrupted token entry from database for user {user_id}.")
         except Exception as e:
             logger.error(f"Failed to delete invalid token entry for user {user_id}: {e}")
@@ -485,6 +524,7 @@ class OAuthManager:
     def is_authenticated(self, user_id: str) -> bool:
         """
         Checks authentication status to ensure API access is available.
+        Results are reused for a short time, since handlers check on every message.
 
         Args:
             user_id: Unique ID of the user.
@@ -492,5 +532,22 @@ class OAuthManager:
         Returns:
             True if the user has valid credentials, False otherwise.
         """
+        with self._auth_status_lock:
+            cached = self._auth_status.get(user_id)
+            generation = self._auth_generation.get(user_id, 0)
+        if cached is not None and time.monotonic() - cached[1] < self.AUTH_STATUS_TTL_SECONDS:
+            return cached[0]
+
         credentials = self.get_credentials(user_id)
-        return credentials is not None and credentials.valid
+        authenticated = credentials is not None and credentials.valid
+        with self._auth_status_lock:
+            # A token saved or deleted while checking makes this result stale; don't cache it
+            if self._auth_generation.get(user_id, 0) == generation:
+                self._auth_status[user_id] = (authenticated, time.monotonic())
+        return authenticated
+
+    def _invalidate_auth_status(self, user_id: str) -> None:
+        """Drops the cached is_authenticated result after the user's stored token changes."""
+        with self._auth_status_lock:
+            self._auth_status.pop(user_id, None)
+            self._auth_generation[user_id] = self._auth_generation.get(user_id, 0) + 1
@@ -1,3 +1,5 @@
+import asyncio
+
 from google.auth.exceptions import GoogleAuthError
 from gspread.exceptions import APIError, SpreadsheetNotFound
 from loguru import logger
@@ -6,11 +8,11 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.constants import ParseMode
-from telegram.ext import ContextTypes
 
 from ..auth.oauth import OAuthManager
 from ..db.database import SessionLocal, User, UserSheet
 from ..sheets.operations import SheetsOperations
+from .context import BotContext
 
 # --- Helper Functions ---
 
@@ -107,7 +109,7 @@ def _set_active_sheet(db: Session, user_id: str, spreadsheet_id: str, spreadshee
 # --- Command Handlers ---
 
 
-async def auth_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def auth_command(update: Update, context: BotContext) -> None:
     """
     Initiates OAuth 2.0 flow for secure Google Sheets access.
     Generates authorization link and updates user details in DB.
@@ -117,7 +119,7 @@ async def auth_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     user_id = str(update.effective_user.id)
-    oauth_manager: OAuthManager | None = context.bot_data.get("oauth_manager")
+    oauth_manager: OAuthManager | None = context.bot_data.oauth_manager
 
     if not oauth_manager:
         logger.error("OAuthManager not found in bot_data.")
@@ -168,13 +170,13 @@ async def auth_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
 
 
-async def sheet_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def sheet_command(update: Update, context: BotContext) -> None:
     """Sets active spreadsheet and verifies access for user transactions."""
     if not update.effective_user or not update.message:
         return
     user_id = str(update.effective_user.id)
-    sheets_operations: SheetsOperations | None = context.bot_data.get("sheets_operations")
-    oauth_manager: OAuthManager | None = context.bot_data.get("oauth_manager")
+    sheets_operations: SheetsOperations | None = context.bot_data.sheets_operations
+    oauth_manager: OAuthManager | None = context.bot_data.oauth_manager
 
     if not sheets_operations or not oauth_manager:
         logger.error("SheetsOperations or OAuthManager not found in bot_data for /sheet.")
@@ -196,12 +198,15 @@ async def sheet_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         wait_message = await update.message.reply_text(f"Verifying and configuring sheet '{spreadsheet_id}'...")
 
         # Verify access and get title
-        spreadsheet_title = sheets_operations.setup_for_user(user_id, spreadsheet_id)
+        # Setup makes several dependent Sheets API calls; run it off the event loop
+        spreadsheet_title = await asyncio.to_thread(sheets_operations.setup_for_user, user_id, spreadsheet_id)
 
         if spreadsheet_title:
             # Store the active sheet ID and title in the database
             db = SessionLocal()
             success = _set_active_sheet(db, user_id, spreadsheet_id, spreadsheet_title)
+            # Drop the cached ID even on failure: the DB row may have changed before the error
+            sheets_operations.invalidate_active_spreadsheet(user_id)
             if success:
                 await wait_message.edit_text(
                     f"✅ Spreadsheet *{spreadsheet_title}* selected.\n\nNow you can use commands like /add with this sheet.",
@@ -250,13 +255,14 @@ async def sheet_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             db.close()
 
 
-async def logout_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def logout_command(update: Update, context: BotContext) -> None:
     """Revokes access and clears database data for security and clean state."""
     if not update.effective_user or not update.message:
         return
     user_id = str(update.effective_user.id)
-    oauth_manager: OAuthManager | None = context.bot_data.get("oauth_manager")
-    sheets_client = context.bot_data.get("sheets_client")
+    oauth_manager: OAuthManager | None = context.bot_data.oauth_manager
+    sheets_client = context.bot_data.sheets_client
+    sheets_operations = context.bot_data.sheets_operations
 
     if not oauth_manager:
         logger.error("OAuthManager not found in bot_data for /logout.")
@@ -278,7 +284,7 @@ async def logout_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         logger.info(f"Attempting logout for user {user_id}")
         # Revoke token with Google and delete from DB
-        revoked = oauth_manager.revoke_token(user_id)
+        revoked = await asyncio.to_thread(oauth_manager.revoke_token, user_id)
 
         if revoked:
             logger.info(f"Token revocation/cleanup successful for user {user_id}")
@@ -311,6 +317,8 @@ async def logout_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             logger.debug(f"Cleared sheets_client cache for user {user_id}")
         else:
             logger.debug("SheetsClient or clear_user_cache method not found, skipping cache clear.")
+        if sheets_operations:
+            sheets_operations.clear_user_cache(user_id)
 
         await update.message.reply_text(
             "✅ You have successfully logged out.\n\n"
@@ -328,7 +336,7 @@ async def logout_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 # --- OAuth Callback Handling Logic ---
 
 
-async def _send_auth_success_message(context: ContextTypes.DEFAULT_TYPE) -> None:
+async def _send_auth_success_message(context: BotContext) -> None:
     """Sends success message after OAuth callback for better user experience."""
     job_data = context.job.data if context.job else {}
     user_id = job_data.get("user_id")
@@ -57,12 +57,12 @@ class TelegramBot:
         self.application = existing_application
 
         # Ensure required references are in bot_data
-        self.application.bot_data["sheets_operations"] = self.sheets
-        self.application.bot_data["oauth_manager"] = self.oauth_manager
+        self.application.bot_data.sheets_operations = self.sheets
+        self.application.bot_data.oauth_manager = self.oauth_manager
 
         # Add sheets_client if needed for handlers
         if isinstance(self.sheets.client, GoogleSheetsClient):
-            self.application.bot_data["sheets_client"] = self.sheets.client
+            self.application.bot_data.sheets_client = self.sheets.client
 
         # Register basic command handlers
         self.application.add_handler(CommandHandler("start", start_command))
@@ -0,0 +1,31 @@
+"""
+Typed bot-wide state shared with the Telegram handlers.
+"""
+
+from dataclasses import dataclass
+
+from telegram.ext import CallbackContext, ContextTypes, ExtBot
+
+from ..auth.oauth import OAuthManager
+from ..sheets.client import GoogleSheetsClient
+from ..sheets.operations import SheetsOperations
+
+
+@dataclass
+class BotData:
+    """
+    Application services available to every handler through `context.bot_data`.
+
+    Plain attributes replace string-keyed dict lookups on each update.
+    """
+
+    oauth_manager: OAuthManager | None = None
+    sheets_operations: SheetsOperations | None = None
+    sheets_client: GoogleSheetsClient | None = None
+
+
+# Handler context type with a typed bot_data namespace
+BotContext = CallbackContext[ExtBot, dict, dict, BotData]
+
+# Context types to pass to ApplicationBuilder.context_types()
+CONTEXT_TYPES = ContextTypes(bot_data=BotData)
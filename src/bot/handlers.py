@@ -2,19 +2,34 @@
 Message and command handlers for the Telegram bot.
 """
 
+import asyncio
 import datetime
+from typing import Any
 
 import yaml
 from gspread.exceptions import APIError, WorksheetNotFound  # Import other relevant exceptions
 from loguru import logger
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
-from telegram.ext import ContextTypes
 
 from src.config.categories import category_manager
 from src.sheets.operations import MissingHeadersError, SheetsOperations
 
-from ..db.database import SessionLocal
+from ..db.database import db_session
+from .context import BotContext
+
+# Prefer the libyaml-backed safe loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Static keyboard for the /editcat menu, built once since its buttons never change
+EDIT_CATEGORIES_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("✏️ Edit expense categories", callback_data="edit_categories|expense")],
+        [InlineKeyboardButton("✏️ Edit income categories", callback_data="edit_categories|income")],
+        [InlineKeyboardButton("📝 Import from YAML", callback_data="edit_categories|import")],
+        [InlineKeyboardButton("📦 Export to YAML", callback_data="edit_categories|export")],
+    ]
+)
 
 
 def get_category_keyboard(expense_type: str = "expense", user_id: str = None) -> InlineKeyboardMarkup:
@@ -74,7 +89,7 @@ def get_subcategory_keyboard(main_category: str, expense_type: str, user_id: str
     return InlineKeyboardMarkup(buttons)
 
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def start_command(update: Update, context: BotContext) -> None:
     """
     Handles /start command to onboard new users.
 
@@ -90,7 +105,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
 
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def help_command(update: Update, context: BotContext) -> None:
     """
     Handles /help command to provide guidance.
 
@@ -130,7 +145,7 @@ def get_type_selector_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(buttons)
 
 
-async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def add_command(update: Update, context: BotContext) -> None:
     """
     Handles /add command to start transaction recording process.
     Shows buttons to choose between expense or income.
@@ -142,7 +157,7 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     user = update.effective_user
     user_id = str(user.id)
 
-    oauth_manager = context.bot_data.get("oauth_manager")
+    oauth_manager = context.bot_data.oauth_manager
 
     if not oauth_manager or not oauth_manager.is_authenticated(user_id):
         await update.message.reply_text(
@@ -160,7 +175,7 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 
 async def register_transaction(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, expense_type: str, amount: float, category: str, subcategory: str, date: str, comment: str
+    update: Update, context: BotContext, expense_type: str, amount: float, category: str, subcategory: str, date: str, comment: str
 ) -> None:
     """
     Records a transaction in the spreadsheet to maintain financial tracking.
@@ -177,7 +192,7 @@ async def register_transaction(
     """
     user = update.effective_user
     user_id = str(user.id)
-    sheets_ops: SheetsOperations = context.bot_data.get("sheets_operations")
+    sheets_ops: SheetsOperations = context.bot_data.sheets_operations
     if expense_type == "expense":
         sheet_name = "expenses"
         row_data = [
@@ -201,7 +216,8 @@ async def register_transaction(
         ]
 
     try:
-        sheets_ops.append_row(user_id, sheet_name, row_data)
+        # Off the event loop, so queued rows for the same sheet can be coalesced
+        await asyncio.to_thread(sheets_ops.append_row, user_id, sheet_name, row_data)
         sign = "-" if expense_type == "expense" else "+"
 
         # For income, where category and subcategory are the same, only show once
@@ -247,7 +263,7 @@ async def register_transaction(
         logger.exception(f"Unhandled error adding transaction for user {user_id}: {e}")
 
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def button_callback(update: Update, context: BotContext) -> None:
     """
     Handles button interactions for guided transaction entry.
 
@@ -261,7 +277,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = str(update.effective_user.id)
 
     # Verify authentication before processing callbacks
-    oauth_manager = context.bot_data.get("oauth_manager")
+    oauth_manager = context.bot_data.oauth_manager
     if not oauth_manager or not oauth_manager.is_authenticated(user_id):
         # Don't interrupt flow for buttons that don't require authentication
         # but validate when it's a transaction flow
@@ -282,13 +298,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         try:
             # Load user's custom categories
-            db = SessionLocal()
-            try:
-                category_manager.load_user_categories(user_id, db)
-            except Exception as db_error:
-                logger.error(f"Error loading user categories: {db_error}")
-            finally:
-                db.close()
+            with db_session() as db:
+                try:
+                    category_manager.load_user_categories(user_id, db)
+                except Exception as db_error:
+                    logger.error(f"Error loading user categories: {db_error}")
 
             # Update message with new category keyboard based on selected type and user preferences
             keyboard = get_category_keyboard(expense_type, user_id)
@@ -314,13 +328,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if expense_type == "expense":
             try:
                 # Load user's custom categories
-                db = SessionLocal()
-                try:
-                    category_manager.load_user_categories(user_id, db)
-                except Exception as db_error:
-                    logger.error(f"Error loading user categories for subcategories: {db_error}")
-                finally:
-                    db.close()
+                with db_session() as db:
+                    try:
+                        category_manager.load_user_categories(user_id, db)
+                    except Exception as db_error:
+                        logger.error(f"Error loading user categories for subcategories: {db_error}")
 
                 # Create keyboard with subcategories based on user preferences
                 keyboard = get_subcategory_keyboard(category, expense_type, user_id)
@@ -358,13 +370,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         try:
             # Load user's custom categories
-            db = SessionLocal()
-            try:
-                category_manager.load_user_categories(user_id, db)
-            except Exception as db_error:
-                logger.error(f"Error loading user categories for back action: {db_error}")
-            finally:
-                db.close()
+            with db_session() as db:
+                try:
+                    category_manager.load_user_categories(user_id, db)
+                except Exception as db_error:
+                    logger.error(f"Error loading user categories for back action: {db_error}")
 
             # Show main categories again with user preferences
             keyboard = get_category_keyboard(expense_type, user_id)
@@ -459,8 +469,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
             # Clear temporary data
             del context.user_data["pending_transaction"]
-            if "state" in context.user_data:
-                del context.user_data["state"]
+            context.user_data.pop("state", None)
 
         return
 
@@ -470,9 +479,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         if option == "confirm":
             # Reset user categories to defaults
-            db = SessionLocal()
             try:
-                success = category_manager.reset_user_categories(user_id, db)
+                with db_session() as db:
+                    success = category_manager.reset_user_categories(user_id, db)
                 if success:
                     await query.edit_message_text("✅ Your categories have been reset to default values.")
                 else:
@@ -480,8 +489,6 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             except Exception as e:
                 logger.error(f"Error resetting categories for user {user_id}: {e}")
                 await query.edit_message_text("❌ Error resetting categories.")
-            finally:
-                db.close()
         else:  # option == "cancel"
             await query.edit_message_text("⚠️ Operation cancelled. Your categories have not been modified.")
         return
@@ -527,7 +534,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.edit_message_text("❌ Unrecognized action. Use /add to start again.")
 
 
-async def amount_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def amount_handler(update: Update, context: BotContext) -> None:
     """
     Handles amount input after category selection for proper transaction recording.
 
@@ -589,7 +596,7 @@ async def amount_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("❌ Error processing the transaction. Please try again with /add.")
 
 
-async def comment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def comment_handler(update: Update, context: BotContext) -> None:
     """
     Handles comment input and finalizes transaction recording for complete data.
 
@@ -625,8 +632,7 @@ async def comment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         # Clear temporary data
         del context.user_data["pending_transaction"]
-        if "state" in context.user_data:
-            del context.user_data["state"]
+        context.user_data.pop("state", None)
 
     except Exception as e:
         # If any error occurs, inform user and log it
@@ -634,7 +640,7 @@ async def comment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("❌ Error processing the transaction. Please try again with /add.")
 
 
-async def register_bot_commands(context: ContextTypes.DEFAULT_TYPE) -> None:
+async def register_bot_commands(context: BotContext) -> None:
     """
     Registers bot commands in Telegram for user discoverability.
     This handler runs at bot startup.
@@ -652,7 +658,7 @@ async def register_bot_commands(context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error(f"Error registering bot commands: {e}")
 
 
-async def show_categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def show_categories_command(update: Update, context: BotContext) -> None:
     """
     Shows user's categories.
 
@@ -664,15 +670,15 @@ async def show_categories_command(update: Update, context: ContextTypes.DEFAULT_
     user_id = str(user.id)
 
     # Verify authentication
-    oauth_manager = context.bot_data.get("oauth_manager")
+    oauth_manager = context.bot_data.oauth_manager
     if not oauth_manager or not oauth_manager.is_authenticated(user_id):
         await update.message.reply_text("⚠️ You need to authenticate first.\n\nUse /auth to start the authorization process.")
         return
 
     # Get user categories
-    db = SessionLocal()
     try:
-        category_manager.load_user_categories(user_id, db)
+        with db_session() as db:
+            category_manager.load_user_categories(user_id, db)
 
         expense_categories = category_manager.get_expense_categories(user_id)
         income_categories = category_manager.get_income_categories(user_id)
@@ -694,11 +700,9 @@ async def show_categories_command(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         logger.error(f"Error showing categories for user {user_id}: {e}")
         await update.message.reply_text("❌ Error retrieving your categories.")
-    finally:
-        db.close()
 
 
-async def reset_categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def reset_categories_command(update: Update, context: BotContext) -> None:
     """
     Resets user's categories to default values.
 
@@ -710,7 +714,7 @@ async def reset_categories_command(update: Update, context: ContextTypes.DEFAULT
     user_id = str(user.id)
 
     # Verify authentication
-    oauth_manager = context.bot_data.get("oauth_manager")
+    oauth_manager = context.bot_data.oauth_manager
     if not oauth_manager or not oauth_manager.is_authenticated(user_id):
         await update.message.reply_text("⚠️ You need to authenticate first.\n\nUse /auth to start the authorization process.")
         return
@@ -730,7 +734,7 @@ async def reset_categories_command(update: Update, context: ContextTypes.DEFAULT
     )
 
 
-async def edit_categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def edit_categories_command(update: Update, context: BotContext) -> None:
     """
     Starts the category editing flow.
 
@@ -742,25 +746,106 @@ async def edit_categories_command(update: Update, context: ContextTypes.DEFAULT_
     user_id = str(user.id)
 
     # Verify authentication
-    oauth_manager = context.bot_data.get("oauth_manager")
+    oauth_manager = context.bot_data.oauth_manager
     if not oauth_manager or not oauth_manager.is_authenticated(user_id):
         await update.message.reply_text("⚠️ You need to authenticate first.\n\nUse /auth to start the authorization process.")
         return
 
     # Show editing options
-    keyboard = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("✏️ Edit expense categories", callback_data="edit_categories|expense")],
-            [InlineKeyboardButton("✏️ Edit income categories", callback_data="edit_categories|income")],
-            [InlineKeyboardButton("📝 Import from YAML", callback_data="edit_categories|import")],
-            [InlineKeyboardButton("📦 Export to YAML", callback_data="edit_categories|export")],
-        ]
+    await update.message.reply_text("What would you like to do with your categories?", reply_markup=EDIT_CATEGORIES_KEYBOARD)
+
+
+def _validate_categories_data(categories_data: Any) -> str | None:
+    """
+    Checks that imported categories match the expected structure.
+
+    Args:
+        categories_data: Parsed YAML content
+
+    Returns:
+        User-facing error message, or None if the structure is valid
+    """
+    if not isinstance(categories_data, dict):
+        return "❌ Incorrect format. The file must contain a YAML dictionary."
+
+    if "expense_categories" not in categories_data or "income_categories" not in categories_data:
+        return "❌ Incorrect format. The file must contain 'expense_categories' and 'income_categories'."
+
+    expense_categories = categories_data["expense_categories"]
+    income_categories = categories_data["income_categories"]
+
+    if not isinstance(expense_categories, dict) or not isinstance(income_categories, list):
+        return "❌ Incorrect format. 'expense_categories' must be a dictionary and 'income_categories' a list."
+
+    # Only the first offending category is needed for the error message
+    invalid_category = next((category for category, subcategories in expense_categories.items() if not isinstance(subcategories, list)), None)
+    if invalid_category is not None:
+        return f"❌ Incorrect format. Subcategories for '{invalid_category}' must be a list."
+
+    invalid_category = next(
+        (category for category, subcategories in expense_categories.items() if not all(isinstance(item, str) for item in subcategories)),
+        None,
     )
+    if invalid_category is not None:
+        return f"❌ Incorrect format. Subcategories for '{invalid_category}' must be text."
+
+    if not all(isinstance(category, str) for category in income_categories):
+        return "❌ Incorrect format. 'income_categories' must contain only text."
 
-    await update.message.reply_text("What would you like to do with your categories?", reply_markup=keyboard)
+    return None
 
 
-async def process_yaml_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def _import_categories(user_id: str, yaml_content: bytes) -> str:
+    """
+    Parses, validates and saves imported categories. Runs in a worker thread.
+
+    Args:
+        user_id: User's unique ID
+        yaml_content: Raw content of the uploaded YAML file
+
+    Returns:
+        Reply message for the user
+
+    Raises:
+        yaml.YAMLError: If the file is not valid YAML
+    """
+    # The loader decodes UTF-8 itself, so skip building an intermediate str
+    categories_data = yaml.load(yaml_content, Loader=YAML_LOADER)
+
+    validation_error = _validate_categories_data(categories_data)
+    if validation_error:
+        return validation_error
+
+    expense_categories = categories_data["expense_categories"]
+    income_categories = categories_data["income_categories"]
+
+    with db_session() as db:
+        success = category_manager.save_user_categories(user_id, expense_categories, income_categories, db)
+
+    return "✅ Categories imported successfully." if success else "❌ Error saving categories."
+
+
+def _dump_categories(user_id: str) -> bytes:
+    """
+    Loads a user's categories and serializes them as YAML. Runs in a worker thread.
+
+    Args:
+        user_id: User's unique ID
+
+    Returns:
+        UTF-8 encoded YAML document
+    """
+    with db_session() as db:
+        category_manager.load_user_categories(user_id, db)
+
+    categories_data = {
+        "expense_categories": category_manager.get_expense_categories(user_id),
+        "income_categories": category_manager.get_income_categories(user_id),
+    }
+    return yaml.safe_dump(categories_data, allow_unicode=True, sort_keys=False).encode("utf-8")
+
+
+async def process_yaml_import(update: Update, context: BotContext) -> None:
     """
     Processes a YAML file to import categories.
 
@@ -786,41 +871,10 @@ async def process_yaml_import(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Download file
         file_obj = await context.bot.get_file(file.file_id)
         yaml_content = await file_obj.download_as_bytearray()
-        yaml_text = yaml_content.decode("utf-8")
-
-        categories_data = yaml.safe_load(yaml_text)
-
-        if not isinstance(categories_data, dict):
-            await update.message.reply_text("❌ Incorrect format. The file must contain a YAML dictionary.")
-            return
-
-        if "expense_categories" not in categories_data or "income_categories" not in categories_data:
-            await update.message.reply_text("❌ Incorrect format. The file must contain 'expense_categories' and 'income_categories'.")
-            return
-
-        expense_categories = categories_data["expense_categories"]
-        income_categories = categories_data["income_categories"]
-
-        if not isinstance(expense_categories, dict) or not isinstance(income_categories, list):
-            await update.message.reply_text("❌ Incorrect format. 'expense_categories' must be a dictionary and 'income_categories' a list.")
-            return
-
-        for category, subcategories in expense_categories.items():
-            if not isinstance(subcategories, list):
-                await update.message.reply_text(f"❌ Incorrect format. Subcategories for '{category}' must be a list.")
-                return
-
-        db = SessionLocal()
-        try:
-            success = category_manager.save_user_categories(user_id, expense_categories, income_categories, db)
-
-            if success:
-                await update.message.reply_text("✅ Categories imported successfully.")
-            else:
-                await update.message.reply_text("❌ Error saving categories.")
 
-        finally:
-            db.close()
+        # Parsing and saving block, so keep them off the event loop
+        reply = await asyncio.to_thread(_import_categories, user_id, bytes(yaml_content))
+        await update.message.reply_text(reply)
 
     except yaml.YAMLError as e:
         await update.message.reply_text(f"❌ Error parsing YAML file: {str(e)}")
@@ -831,7 +885,7 @@ async def process_yaml_import(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data.pop("state", None)  # Clear state on error
 
 
-async def export_categories_to_yaml(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def export_categories_to_yaml(update: Update, context: BotContext) -> None:
     """
     Exports user's categories to a YAML file.
 
@@ -842,34 +896,15 @@ async def export_categories_to_yaml(update: Update, context: ContextTypes.DEFAUL
     user = update.effective_user
     user_id = str(user.id)
 
-    db = SessionLocal()
     try:
-        category_manager.load_user_categories(user_id, db)
-
-        expense_categories = category_manager.get_expense_categories(user_id)
-        income_categories = category_manager.get_income_categories(user_id)
-
-        categories_data = {"expense_categories": expense_categories, "income_categories": income_categories}
-
-        yaml_content = yaml.safe_dump(categories_data, allow_unicode=True, sort_keys=False)
-
-        import tempfile
+        yaml_content = await asyncio.to_thread(_dump_categories, user_id)
 
-        temp_file = tempfile.NamedTemporaryFile(suffix=".yaml", delete=False)
-        temp_file.write(yaml_content.encode("utf-8"))
-        temp_file.close()
-
-        with open(temp_file.name, "rb") as file:
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=file,
-                filename=f"categories_{user.username or user_id}.yaml",
-                caption="📦 Your custom categories",
-            )
-
-        import os
-
-        os.unlink(temp_file.name)
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=yaml_content,
+            filename=f"categories_{user.username or user_id}.yaml",
+            caption="📦 Your custom categories",
+        )
 
     except Exception as e:
         logger.error(f"Error exporting YAML categories for user {user_id}: {e}")
@@ -877,11 +912,9 @@ async def export_categories_to_yaml(update: Update, context: ContextTypes.DEFAUL
             await update.callback_query.edit_message_text("❌ Error exporting your categories.")
         elif update.effective_message:
             await update.effective_message.reply_text("❌ Error exporting your categories.")
-    finally:
-        db.close()
 
 
-async def error_handler(update: Update | None, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def error_handler(update: Update | None, context: BotContext) -> None:
     """
     Global error handler for graceful error management.
 
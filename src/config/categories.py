@@ -2,16 +2,15 @@
 Module for managing financial system categories.
 """
 
-import datetime
 import json
 from pathlib import Path
 
 import yaml
 from loguru import logger
-from sqlalchemy import select
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
 
-from ..db.database import UserCategories
+from ..db.database import UserCategories, upsert_insert
 
 
 class CategoryManager:
@@ -38,6 +37,11 @@ class CategoryManager:
         self._default_expense_categories: dict[str, list[str]] = {}
         self._default_income_categories: list[str] = []
         self._user_categories: dict[str, dict] = {}
+        # Precomputed read-only views used when building keyboards
+        self._default_category_names: tuple[str, ...] = ()
+        self._default_subcategories: dict[str, tuple[str, ...]] = {}
+        self._user_category_names: dict[str, tuple[str, ...]] = {}
+        self._user_subcategories: dict[str, dict[str, tuple[str, ...]]] = {}
         self._load_default_categories()
 
     def _load_default_categories(self) -> None:
@@ -55,6 +59,7 @@ class CategoryManager:
                 self._default_expense_categories = config.get("expense_categories", {})
                 self._default_income_categories = config.get("income_categories", [])
 
+            self._default_category_names, self._default_subcategories = self._build_lookups(self._default_expense_categories)
             logger.info(f"Default categories successfully loaded from {self.config_path}")
             logger.debug(
                 f"Default expense categories: {len(self._default_expense_categories)}, Default income categories: {len(self._default_income_categories)}"
@@ -70,6 +75,22 @@ class CategoryManager:
             logger.error(f"Unexpected error loading default categories: {e}")
             raise
 
+    @staticmethod
+    def _build_lookups(expense_categories: dict[str, list[str]]) -> tuple[tuple[str, ...], dict[str, tuple[str, ...]]]:
+        """Builds immutable category name and subcategory views for repeated reads."""
+        return tuple(expense_categories.keys()), {category: tuple(subcategories) for category, subcategories in expense_categories.items()}
+
+    def _set_user_categories(self, user_id: str, categories_dict: dict) -> None:
+        """Stores a user's categories in memory along with their precomputed lookups."""
+        self._user_categories[user_id] = categories_dict
+        self._user_category_names[user_id], self._user_subcategories[user_id] = self._build_lookups(categories_dict["expense_categories"])
+
+    def _clear_user_categories(self, user_id: str) -> None:
+        """Removes a user's categories and lookups from the in-memory cache."""
+        self._user_categories.pop(user_id, None)
+        self._user_category_names.pop(user_id, None)
+        self._user_subcategories.pop(user_id, None)
+
     def load_user_categories(self, user_id: str, db_session: Session) -> None:
         """
         Loads user-specific categories from database, falls back to defaults if not found.
@@ -80,26 +101,21 @@ class CategoryManager:
         """
         try:
             # Query user categories from the database
-            stmt = select(UserCategories).where(UserCategories.user_id == user_id)
-            user_categories = db_session.scalars(stmt).first()
+            stmt = select(UserCategories.categories_json).where(UserCategories.user_id == user_id)
+            categories_json = db_session.execute(stmt).scalar_one_or_none()
 
-            if user_categories:
-                categories_dict = json.loads(user_categories.categories_json)
-                self._user_categories[user_id] = categories_dict
+            if categories_json:
+                categories_dict = json.loads(categories_json)
+                self._set_user_categories(user_id, categories_dict)
                 logger.info(f"Loaded custom categories for user {user_id}")
             else:
-                self._user_categories[user_id] = {
-                    "expense_categories": self._default_expense_categories,
-                    "income_categories": self._default_income_categories,
-                }
+                # Users on defaults are not cached; the getters fall back to the defaults
+                self._clear_user_categories(user_id)
                 logger.info(f"Using default categories for user {user_id}")
 
         except Exception as e:
             logger.error(f"Error loading categories for user {user_id}: {e}")
-            self._user_categories[user_id] = {
-                "expense_categories": self._default_expense_categories,
-                "income_categories": self._default_income_categories,
-            }
+            self._clear_user_categories(user_id)
 
     def save_user_categories(self, user_id: str, expense_categories: dict[str, list[str]], income_categories: list[str], db_session: Session) -> bool:
         """
@@ -119,19 +135,17 @@ class CategoryManager:
 
             categories_json = json.dumps(categories_dict, ensure_ascii=False)
 
-            stmt = select(UserCategories).where(UserCategories.user_id == user_id)
-            existing = db_session.scalars(stmt).first()
-
-            if existing:
-                existing.categories_json = categories_json
-                existing.updated_at = datetime.datetime.now()
-            else:
-                new_categories = UserCategories(user_id=user_id, categories_json=categories_json)
-                db_session.add(new_categories)
-
+            # Single INSERT ... ON CONFLICT(user_id) DO UPDATE instead of select-then-write
+            insert = upsert_insert(db_session)
+            stmt = insert(UserCategories).values(user_id=user_id, categories_json=categories_json)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserCategories.user_id],
+                set_={"categories_json": stmt.excluded.categories_json, "updated_at": func.now()},
+            )
+            db_session.execute(stmt)
             db_session.commit()
 
-            self._user_categories[user_id] = categories_dict
+            self._set_user_categories(user_id, categories_dict)
 
             logger.info(f"Categories saved successfully for user {user_id}")
             return True
@@ -151,8 +165,9 @@ class CategoryManager:
         Returns:
             Dictionary with expense categories and their subcategories
         """
-        if user_id in self._user_categories:
-            return self._user_categories[user_id]["expense_categories"]
+        user_categories = self._user_categories.get(user_id)
+        if user_categories is not None:
+            return user_categories["expense_categories"]
         return self._default_expense_categories
 
     def get_income_categories(self, user_id: str) -> list[str]:
@@ -165,8 +180,9 @@ class CategoryManager:
         Returns:
             List with income categories
         """
-        if user_id in self._user_categories:
-            return self._user_categories[user_id]["income_categories"]
+        user_categories = self._user_categories.get(user_id)
+        if user_categories is not None:
+            return user_categories["income_categories"]
         return self._default_income_categories
 
     @property
@@ -189,7 +205,7 @@ class CategoryManager:
         """
         return self._default_income_categories
 
-    def get_expense_category_names(self, user_id: str = None) -> list[str]:
+    def get_expense_category_names(self, user_id: str = None) -> tuple[str, ...]:
         """
         Gets expense category names for UI display.
 
@@ -197,13 +213,13 @@ class CategoryManager:
             user_id: The user's unique identifier (optional)
 
         Returns:
-            List with expense category names.
+            Tuple with expense category names.
         """
-        if user_id and user_id in self._user_categories:
-            return list(self._user_categories[user_id]["expense_categories"].keys())
-        return list(self._default_expense_categories.keys())
+        if user_id:
+            return self._user_category_names.get(user_id, self._default_category_names)
+        return self._default_category_names
 
-    def get_subcategories(self, category: str, user_id: str = None) -> list[str]:
+    def get_subcategories(self, category: str, user_id: str = None) -> tuple[str, ...]:
         """
         Gets subcategories of an expense category for detailed classification.
 
@@ -212,12 +228,11 @@ class CategoryManager:
             user_id: The user's unique identifier (optional)
 
         Returns:
-            List with subcategories of the specified category.
-            Empty list if category doesn't exist.
+            Tuple with subcategories of the specified category.
+            Empty tuple if category doesn't exist.
         """
-        if user_id and user_id in self._user_categories:
-            return self._user_categories[user_id]["expense_categories"].get(category, [])
-        return self._default_expense_categories.get(category, [])
+        subcategories = self._user_subcategories.get(user_id, self._default_subcategories) if user_id else self._default_subcategories
+        return subcategories.get(category, ())
 
     def reset_user_categories(self, user_id: str, db_session: Session) -> bool:
         """
@@ -232,16 +247,12 @@ class CategoryManager:
         """
         try:
             # Delete custom categories from the database
-            stmt = select(UserCategories).where(UserCategories.user_id == user_id)
-            existing = db_session.scalars(stmt).first()
-
-            if existing:
-                db_session.delete(existing)
-                db_session.commit()
+            stmt = delete(UserCategories).where(UserCategories.user_id == user_id)
+            db_session.execute(stmt)
+            db_session.commit()
 
             # Update the in-memory cache
-            if user_id in self._user_categories:
-                del self._user_categories[user_id]
+            self._clear_user_categories(user_id)
 
             logger.info(f"Categories reset to defaults for user {user_id}")
             return True
@@ -3,25 +3,36 @@ Database module for SQLAlchemy setup, models, and session management.
 """
 
 import datetime
+from collections.abc import Iterator
+from contextlib import contextmanager
 
 from loguru import logger
 from sqlalchemy import (
-    BLOB,
     Boolean,
     DateTime,
     ForeignKey,
+    Index,
+    LargeBinary,
     String,
     Text,
+    Connection,
     create_engine,
+    event,
+    inspect,
+    make_url,
+    text,
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.sql import func
 
-from ..utils.config import Config
+from ..utils.config import get_config
 
 # Load database URL from config with fallback for reliability
 try:
-    config = Config()
+    config = get_config()
     DATABASE_URL = config.database_url
 except ValueError as e:
     logger.error(f"Database configuration error: {e}")
@@ -29,10 +40,85 @@ except ValueError as e:
     logger.warning(f"Using fallback database URL: {DATABASE_URL}")
 
 
-# Create SQLAlchemy engine for database access
-engine = create_engine(DATABASE_URL)
+# Create SQLAlchemy engine for database access.
+# Connections are pooled so handlers reuse them instead of reconnecting per call.
+_db_url = make_url(DATABASE_URL)
+_engine_kwargs: dict = {
+    "pool_pre_ping": True,
+    "insertmanyvalues_page_size": 1000,  # Rows per batched multi-row INSERT
+    "query_cache_size": 1200,  # Compiled statement cache entries
+}
+if _db_url.get_backend_name() == "sqlite":
+    # Sessions are used from the bot event loop and the OAuth server threads
+    _engine_kwargs["connect_args"] = {"check_same_thread": False}
+    if _db_url.database in (None, "", ":memory:"):
+        # A single shared connection keeps every thread on the same in-memory database
+        _engine_kwargs["poolclass"] = StaticPool
+    else:
+        _engine_kwargs.update(poolclass=QueuePool, pool_size=5, max_overflow=10)
+else:
+    _engine_kwargs.update(pool_size=5, max_overflow=10)
+
+engine = create_engine(DATABASE_URL, **_engine_kwargs)
+
+if engine.dialect.name == "sqlite":
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        """Uses WAL with relaxed syncing so commits avoid a full fsync each time."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-64000")  # 64 MB page cache per connection
+        cursor.execute("PRAGMA busy_timeout=5000")  # Wait for concurrent writers instead of failing
+        cursor.close()
+
+    @event.listens_for(engine, "close")
+    def _optimize_sqlite(dbapi_connection, connection_record) -> None:
+        """Lets SQLite refresh query planner statistics before a pooled connection is closed."""
+        dbapi_connection.execute("PRAGMA optimize")
+
+
+# Larger pages fit more rows per page, so primary-key lookups cross fewer b-tree levels as tables grow.
+# Encrypted tokens (about 1 KB) stay inline rather than spilling to overflow pages at either size.
+SQLITE_PAGE_SIZE = 8192
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Thread-local sessions for the OAuth server and the Sheets worker threads; callers close or remove them after use
+ScopedSession = scoped_session(SessionLocal)
+
+
+@contextmanager
+def db_session() -> Iterator[Session]:
+    """
+    Provides a database session that is always closed afterwards.
+
+    Yields:
+        SQLAlchemy session bound to the application engine
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def upsert_insert(db: Session):
+    """
+    Returns the dialect-specific INSERT construct supporting ON CONFLICT clauses.
+
+    Args:
+        db: Session whose bind determines the dialect
+
+    Returns:
+        The PostgreSQL or SQLite `insert` function
+    """
+    return postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+
 
 # Base class for models
 class Base(DeclarativeBase):
@@ -64,7 +150,7 @@ class AuthToken(Base):
     __tablename__ = "auth_tokens"
 
     user_id: Mapped[str] = mapped_column(String, ForeignKey("users.user_id"), primary_key=True)
-    encrypted_token: Mapped[bytes] = mapped_column(BLOB, nullable=False)
+    encrypted_token: Mapped[bytes] = mapped_column(LargeBinary(), nullable=False)
     token_expiry: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     created_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -77,6 +163,8 @@ class UserSheet(Base):
     """SQLAlchemy model for associating users with their Google Sheets to track active sheets."""
 
     __tablename__ = "user_sheets"
+    # Serves the "active sheet for user" filter on (user_id, is_active)
+    __table_args__ = (Index("ix_user_sheets_user_active", "user_id", "is_active"),)
 
     user_id: Mapped[str] = mapped_column(String, ForeignKey("users.user_id"), primary_key=True)
     spreadsheet_id: Mapped[str] = mapped_column(Text, nullable=False)
@@ -94,8 +182,8 @@ class UserCategories(Base):
 
     __tablename__ = "user_categories"
 
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    user_id: Mapped[str] = mapped_column(String, ForeignKey("users.user_id"), index=True)
+    # One row per user; the primary key doubles as the lookup index for user_id queries
+    user_id: Mapped[str] = mapped_column(String, ForeignKey("users.user_id"), primary_key=True)
     categories_json: Mapped[str] = mapped_column(Text, nullable=False)  # Categorías en formato JSON
     created_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -107,12 +195,79 @@ class UserCategories(Base):
 # --- Database Initialization ---
 
 
+def _ensure_sqlite_page_size() -> None:
+    """
+    Sets the SQLite page size, rebuilding an existing database file once if needed.
+
+    A WAL database can't change its page size, so the rebuild briefly switches
+    back to a rollback journal around the VACUUM.
+    """
+    if engine.dialect.name != "sqlite" or _db_url.database in (None, "", ":memory:"):
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+        if page_size == SQLITE_PAGE_SIZE:
+            return
+
+        logger.info(f"Changing SQLite page size from {page_size} to {SQLITE_PAGE_SIZE} bytes")
+        connection.exec_driver_sql("PRAGMA journal_mode=DELETE")
+        connection.exec_driver_sql(f"PRAGMA page_size={SQLITE_PAGE_SIZE}")
+        connection.exec_driver_sql("VACUUM")
+        connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+
+def _migrate_user_categories(connection: Connection) -> None:
+    """
+    Rebuilds a `user_categories` table still keyed by the old surrogate `id` column.
+
+    `create_all` never alters existing tables, so databases created before `user_id`
+    became the primary key are rebuilt once, keeping each user's most recent row.
+
+    Args:
+        connection: Connection inside the transaction the rebuild runs in
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table(UserCategories.__tablename__):
+        return
+    if inspector.get_pk_constraint(UserCategories.__tablename__)["constrained_columns"] == ["user_id"]:
+        return
+
+    logger.info("Migrating user_categories to one row per user keyed by user_id")
+    latest_rows = connection.execute(
+        text(
+            """
+            SELECT user_id, categories_json, created_at, updated_at
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY updated_at DESC, id DESC) AS row_rank
+                FROM user_categories
+            ) AS ranked
+            WHERE row_rank = 1
+            """
+        ).columns(
+            user_id=String,
+            categories_json=Text,
+            created_at=DateTime(timezone=True),
+            updated_at=DateTime(timezone=True),
+        )
+    ).mappings().all()
+    # Dropping the table also drops its legacy indexes, whose names the new table would otherwise clash with
+    UserCategories.__table__.drop(connection)
+    UserCategories.__table__.create(connection)
+    if latest_rows:
+        connection.execute(UserCategories.__table__.insert(), [dict(row) for row in latest_rows])
+    logger.info(f"Migrated categories for {len(latest_rows)} users")
+
+
 def init_db() -> None:
     """
     Initializes the database to ensure tables exist before application starts.
     """
     logger.info("Initializing database and creating tables if they don't exist...")
     try:
+        _ensure_sqlite_page_size()
+        with engine.begin() as connection:
+            _migrate_user_categories(connection)
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables checked/created successfully.")
     except Exception as e:
@@ -1,14 +1,183 @@
+import html
+import json
+import queue
+import selectors
+import socket
 import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from typing import Callable
-from urllib.parse import urlparse
+from urllib.parse import parse_qsl, urlparse
 
-from flask import Flask, jsonify, request
 from loguru import logger
-from werkzeug.serving import make_server
+
+from ..db.database import ScopedSession
 
 # Define a type hint for the callback function
 OAuthCallbackHandler = Callable[[str, str], str | None]  # Accepts state, code; returns user_id or None
 
+# Static responses are encoded once at import time instead of on every request
+_HEALTH_BODY = json.dumps({"status": "ok"}).encode("utf-8")
+_SHUTDOWN_BODY = json.dumps({"message": "Server shutting down..."}).encode("utf-8")
+
+_SUCCESS_PAGE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Autorización Exitosa</title>
+    <style>
+        body { font-family: Arial, sans-serif; text-align: center; padding: 40px; background-color: #f0f2f5; }
+        .container { background-color: white; border-radius: 8px; padding: 20px; box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1); max-width: 500px; margin: 0 auto; }
+        h1 { color: #4CAF50; }
+        p { color: #666; margin: 20px 0; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>¡Autorización Exitosa!</h1>
+        <p>Has autorizado correctamente el acceso a tus hojas de cálculo de Google.</p>
+        <p>Puedes cerrar esta ventana y volver a tu conversación con el bot.</p>
+    </div>
+</body>
+</html>
+""".encode("utf-8")
+
+# The error page is split around the message so only the escaped text is built per request
+_ERROR_PAGE_PREFIX, _ERROR_PAGE_SUFFIX = (
+    part.encode("utf-8")
+    for part in """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Error de Autorización</title>
+    <style>
+        body { font-family: Arial, sans-serif; text-align: center; padding: 40px; background-color: #f0f2f5; }
+        .container { background-color: white; border-radius: 8px; padding: 20px; box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1); max-width: 500px; margin: 0 auto; }
+        h1 { color: #f44336; }
+        p { color: #666; margin: 20px 0; }
+        .error-message { color: #f44336; font-weight: bold; white-space: pre-wrap; word-wrap: break-word; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Error de Autorización</h1>
+        <p>Ocurrió un error durante el proceso de autorización:</p>
+        <p class="error-message">{error}</p>
+        <p>Por favor, intenta nuevamente con el comando /auth en el bot o contacta al administrador si el problema persiste.</p>
+    </div>
+</body>
+</html>
+""".split("{error}")
+)
+
+
+def _error_page(error_message: str) -> bytes:
+    """Builds the HTML error page around the escaped message."""
+    return b"".join((_ERROR_PAGE_PREFIX, html.escape(error_message).encode("utf-8"), _ERROR_PAGE_SUFFIX))
+
+
+class _PooledHTTPServer(HTTPServer):
+    """
+    HTTP server that handles requests on a bounded pool of worker threads.
+
+    Reusing a small fixed pool avoids spawning a thread per connection when the
+    OAuth redirect and health checks arrive together. Workers are daemon threads,
+    as request threads were before, so a callback stuck in the token exchange
+    can't block interpreter exit. Shutdown is signalled through a socket pair so
+    the serving loop wakes immediately instead of polling.
+    """
+
+    def __init__(self, host: str, port: int, oauth_server: "OAuthServer", max_workers: int) -> None:
+        super().__init__((host, port), _OAuthRequestHandler)
+        self.oauth_server = oauth_server
+        self._requests: queue.SimpleQueue = queue.SimpleQueue()
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"OAuthServerWorker-{index}", daemon=True) for index in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+
+    def serve_forever(self, poll_interval: float | None = None) -> None:
+        """Handles requests until shutdown() writes to the wakeup socket."""
+        with selectors.DefaultSelector() as selector:
+            selector.register(self, selectors.EVENT_READ)
+            selector.register(self._wakeup_reader, selectors.EVENT_READ)
+            while True:
+                for key, _ in selector.select():
+                    if key.fileobj is self._wakeup_reader:
+                        return
+                    self._handle_request_noblock()
+
+    def shutdown(self) -> None:
+        """Wakes the serving loop so it returns without waiting for a poll interval."""
+        self._wakeup_writer.send(b"\0")
+
+    def process_request(self, request, client_address) -> None:
+        """Hands the accepted connection to the worker pool."""
+        self._requests.put((request, client_address))
+
+    def _worker_loop(self) -> None:
+        """Handles queued connections until server_close() sends the stop marker."""
+        while (item := self._requests.get()) is not None:
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        """Closes the listening socket and releases the worker pool."""
+        super().server_close()
+        # Workers exit once they pick up the marker; busy ones are daemons and aren't waited for
+        for _ in self._workers:
+            self._requests.put(None)
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+
+class _OAuthRequestHandler(BaseHTTPRequestHandler):
+    """Routes the OAuth callback, health and shutdown endpoints."""
+
+    server: _PooledHTTPServer
+    # Socket timeout so a stalled client can't hold a worker indefinitely
+    timeout = 30
+
+    def do_GET(self) -> None:
+        path, _, query = self.path.partition("?")
+        if path == "/oauth2callback":
+            try:
+                body = self.server.oauth_server.handle_callback(dict(parse_qsl(query)))
+            finally:
+                # Release the thread-local session used while handling the request
+                ScopedSession.remove()
+            self._send(200, body, "text/html; charset=utf-8")
+        elif path == "/health":
+            self._send(200, _HEALTH_BODY, "application/json")
+        else:
+            self._send(404, b"Not Found", "text/plain")
+
+    def do_POST(self) -> None:
+        # Shutdown route for controlled server termination
+        if self.path == "/shutdown":
+            logger.info("Shutdown request received.")
+            self.server.oauth_server.stop()
+            self._send(200, _SHUTDOWN_BODY, "application/json")
+        else:
+            self._send(404, b"Not Found", "text/plain")
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """Sends access logs to loguru instead of stderr, formatted only if DEBUG is enabled."""
+        logger.opt(lazy=True).debug("OAuth server {} - {}", self.address_string, lambda: format % args)
+
 
 class OAuthServer:
     """
@@ -18,6 +187,9 @@ class OAuthServer:
     and passes them to a registered handler function.
     """
 
+    # Size of the request worker pool; callbacks are rare and short-lived
+    WORKER_THREADS = 4
+
     def __init__(self, host: str, port: int, callback_handler: OAuthCallbackHandler, redirect_uri: str | None) -> None:
         """
         Initializes the OAuth server with required configuration.
@@ -34,65 +206,65 @@ class OAuthServer:
         self.host = host
         self.port = port
         self.callback_handler = callback_handler
-        self.app = Flask(__name__)
-        self.server: make_server | None = None
+        self.server: _PooledHTTPServer | None = None
         self.server_thread: threading.Thread | None = None
         self.redirect_uri = redirect_uri
 
+        # Both URIs are fixed for the server's lifetime, so they are derived once here
+        if not redirect_uri:
+            scheme = "https" if port == 443 else "http"
+            redirect_uri = f"{scheme}://{host}:{port}/oauth2callback"
+        self._redirect_uri = redirect_uri
+
         # Check if redirect URI uses HTTPS if not localhost
-        redirect_uri = self.get_redirect_uri()
         parsed_uri = urlparse(redirect_uri)
         if parsed_uri.scheme != "https" and parsed_uri.hostname not in ("localhost", "127.0.0.1"):
             logger.warning(f"OAuth Redirect URI ({redirect_uri}) is not using HTTPS. This is insecure for production environments.")
 
-        self._setup_routes()
+        base_scheme = "https" if parsed_uri.scheme == "https" else "http"
+        self._base_uri = f"{base_scheme}://{host}:{port}"
 
-    def _setup_routes(self) -> None:
-        """Configures the Flask server routes for OAuth callback handling."""
+    def handle_callback(self, params: dict[str, str]) -> bytes:
+        """
+        Processes the OAuth redirect and builds the page shown to the user.
 
-        @self.app.route("/oauth2callback")
-        def oauth2callback():
-            state = request.args.get("state")
-            code = request.args.get("code")
-            error = request.args.get("error")
-            error_description = request.args.get("error_description")
+        Args:
+            params: Query parameters of the callback URL.
 
-            if error:
-                error_msg = f"OAuth Error: {error}. Description: {error_description or 'N/A'}"
-                logger.error(error_msg)
-                return self._generate_error_page(error_msg)
+        Returns:
+            The encoded HTML success or error page.
+        """
+        state = params.get("state")
+        code = params.get("code")
+        error = params.get("error")
+        error_description = params.get("error_description")
 
-            if not code or not state:
-                error_msg = "Missing 'code' or 'state' parameter in OAuth callback."
-                logger.error(error_msg)
-                return self._generate_error_page(error_msg)
+        if error:
+            error_msg = f"OAuth Error: {error}. Description: {error_description or 'N/A'}"
+            logger.error(error_msg)
+            return _error_page(error_msg)
 
-            try:
-                user_id = self.callback_handler(state, code)
-                if user_id:
-                    logger.info(f"OAuth callback processed successfully for state: {state} (User ID inferred)")
-                    return self._generate_success_page()
-                else:
-                    logger.error(f"OAuth callback handler failed for state: {state}")
-                    return self._generate_error_page("Authentication failed. Invalid state or code.")
-
-            except ValueError as ve:
-                logger.error(f"OAuth state validation failed: {ve}")
-                return self._generate_error_page(f"Authentication failed: {ve}")
-            except Exception as e:
-                logger.exception(f"Error processing OAuth callback for state {state}: {e}")
-                return self._generate_error_page(f"An internal error occurred during authentication: {e}")
+        if not code or not state:
+            error_msg = "Missing 'code' or 'state' parameter in OAuth callback."
+            logger.error(error_msg)
+            return _error_page(error_msg)
 
-        @self.app.route("/health")
-        def health():
-            return jsonify({"status": "ok"})
+        try:
+            user_id = self.callback_handler(state, code)
+            if user_id:
+                logger.info("OAuth callback processed successfully for state: {} (User ID inferred)", state)
+                return _SUCCESS_PAGE
+            else:
+                logger.error("OAuth callback handler failed for state: {}", state)
+                return _error_page("Authentication failed. Invalid state or code.")
 
-        # Shutdown route for controlled server termination
-        @self.app.route("/shutdown", methods=["POST"])
-        def shutdown():
-            logger.info("Shutdown request received.")
-            self.stop()
-            return jsonify({"message": "Server shutting down..."})
+        except ValueError as ve:
+            logger.error("OAuth state validation failed: {}", ve)
+            return _error_page(f"Authentication failed: {ve}")
+        except Exception as e:
+            # Only unexpected failures pay for the full traceback
+            logger.exception("Error processing OAuth callback for state {}: {}", state, e)
+            return _error_page(f"An internal error occurred during authentication: {e}")
 
     def start(self) -> None:
         """Starts the server in a separate thread for non-blocking operation."""
@@ -100,16 +272,17 @@ class OAuthServer:
             logger.warning("OAuth server is already running.")
             return
 
-        # Use werkzeug's make_server for better control
-        self.server = make_server(self.host, self.port, self.app, threaded=True)
+        server = _PooledHTTPServer(self.host, self.port, self, max_workers=self.WORKER_THREADS)
+        self.server = server
 
         def run_server():
             logger.info(f"Starting OAuth callback server on {self.get_base_uri()}")
             try:
-                self.server.serve_forever()
+                server.serve_forever()
             except Exception as e:
                 logger.error(f"OAuth server error: {e}")
             finally:
+                server.server_close()
                 logger.info("OAuth server has stopped.")
 
         self.server_thread = threading.Thread(target=run_server, name="OAuthServerThread")
@@ -118,7 +291,7 @@ class OAuthServer:
         logger.info("OAuth server thread started.")
 
     def stop(self) -> None:
-        """Stops the Flask server cleanly to prevent resource leaks."""
+        """Stops the HTTP server cleanly to prevent resource leaks."""
         if self.server:
             logger.info("Attempting to shut down OAuth server...")
             try:
@@ -138,74 +311,8 @@ class OAuthServer:
 
     def get_base_uri(self) -> str:
         """Gets the base URI for the server to construct callback URLs."""
-        scheme = "http"
-        parsed_uri = urlparse(self.get_redirect_uri())
-        if parsed_uri.scheme == "https":
-            scheme = "https"
-        elif parsed_uri.hostname not in ("localhost", "127.0.0.1"):
-            logger.warning(f"Constructing base URI with http for non-localhost: {parsed_uri.hostname}")
-
-        return f"{scheme}://{self.host}:{self.port}"
+        return self._base_uri
 
     def get_redirect_uri(self) -> str:
         """Gets the full redirect URI for OAuth configuration."""
-        if self.redirect_uri:
-            return self.redirect_uri
-
-        scheme = "http"
-        if self.port == 443:
-            scheme = "https"
-        return f"{scheme}://{self.host}:{self.port}/oauth2callback"
-
-    def _generate_success_page(self) -> str:
-        """Generates a simple HTML success page for user feedback."""
-        return """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Autorización Exitosa</title>
-            <style>
-                body { font-family: Arial, sans-serif; text-align: center; padding: 40px; background-color: #f0f2f5; }
-                .container { background-color: white; border-radius: 8px; padding: 20px; box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1); max-width: 500px; margin: 0 auto; }
-                h1 { color: #4CAF50; }
-                p { color: #666; margin: 20px 0; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>¡Autorización Exitosa!</h1>
-                <p>Has autorizado correctamente el acceso a tus hojas de cálculo de Google.</p>
-                <p>Puedes cerrar esta ventana y volver a tu conversación con el bot.</p>
-            </div>
-        </body>
-        </html>
-        """
-
-    def _generate_error_page(self, error_message: str) -> str:
-        """Generates a simple HTML error page for user feedback."""
-        import html
-
-        escaped_error = html.escape(error_message)
-        return f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Error de Autorización</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; text-align: center; padding: 40px; background-color: #f0f2f5; }}
-                .container {{ background-color: white; border-radius: 8px; padding: 20px; box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1); max-width: 500px; margin: 0 auto; }}
-                h1 {{ color: #f44336; }}
-                p {{ color: #666; margin: 20px 0; }}
-                .error-message {{ color: #f44336; font-weight: bold; white-space: pre-wrap; word-wrap: break-word; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Error de Autorización</h1>
-                <p>Ocurrió un error durante el proceso de autorización:</p>
-                <p class="error-message">{escaped_error}</p>
-                <p>Por favor, intenta nuevamente con el comando /auth en el bot o contacta al administrador si el problema persiste.</p>
-            </div>
-        </body>
-        </html>
-        """
+        return self._redirect_uri
@@ -1,11 +1,25 @@
+import datetime
+import re
 import threading
+import time
 
 import gspread
 from google.auth.exceptions import GoogleAuthError
+from google.oauth2.credentials import Credentials
 from gspread.exceptions import APIError, SpreadsheetNotFound
 from loguru import logger
+from requests.adapters import HTTPAdapter
 
 from ..auth.oauth import OAuthManager
+from .retry import call_with_retry
+
+# Error message fragments, matched case-insensitively in a single scan
+_REVOKED_TOKEN_RE = re.compile(r"invalid_grant|token has been expired or revoked", re.IGNORECASE)
+_AUTH_API_ERROR_RE = re.compile(r"invalid_grant|unauthorized", re.IGNORECASE)
+
+# One connection pool shared by every gspread client in the process, so TLS connections to
+# Google are reused across users. Sessions using it must not be closed, as that closes the pool.
+_SHARED_HTTP_ADAPTER = HTTPAdapter(pool_connections=64, pool_maxsize=256)
 
 
 class GoogleSheetsClient:
@@ -13,9 +27,32 @@ class GoogleSheetsClient:
     Client for interacting with Google Sheets using gspread and secure OAuth 2.0.
 
     Handles authentication and provides methods for spreadsheet operations.
-    Includes basic thread-safety for the client cache.
+    Client cache writes are guarded by striped per-user locks so users don't
+    serialize behind each other; cache hits are served without locking.
     """
 
+    # Number of locks the client cache is striped across (power of two)
+    LOCK_STRIPES = 64
+
+    # How long concurrent callers wait for another thread's authentication
+    AUTH_WAIT_TIMEOUT_SECONDS = 30
+
+    # Background refresh: how often cached credentials are checked, and how far ahead of expiry they are renewed
+    REFRESH_INTERVAL_SECONDS = 60
+    REFRESH_AHEAD_SECONDS = 300
+
+    # Cached clients are used without re-checking credentials until this close to expiry
+    CREDENTIALS_EXPIRY_BUFFER_SECONDS = 60
+
+    # Bounds on the client cache: least recently used clients are evicted past the size limit,
+    # and clients idle this long are dropped (and no longer refreshed in the background)
+    MAX_CACHED_CLIENTS = 10_000
+    CLIENT_IDLE_SECONDS = 24 * 60 * 60
+
+    # Opened spreadsheet handles are reused for a short while to skip repeated metadata fetches
+    SPREADSHEET_TTL_SECONDS = 300
+    MAX_CACHED_SPREADSHEETS = 128
+
     def __init__(self, oauth_manager: OAuthManager) -> None:
         """
         Initializes the Google Sheets client with OAuth manager for secure API access.
@@ -25,12 +62,60 @@ class GoogleSheetsClient:
         """
         self.oauth_manager = oauth_manager
         self.client_cache: dict[str, gspread.Client] = {}
-        self._cache_lock = threading.Lock()  # Lock for thread-safe cache access
+        self._client_credentials: dict[str, Credentials] = {}  # Credentials each cached client was built with
+        self._last_used: dict[str, float] = {}  # Monotonic time of each user's last client request
+        self._spreadsheet_cache: dict[tuple[str, str], tuple[gspread.Spreadsheet, float]] = {}
+        self._client_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._inflight: dict[str, threading.Event] = {}  # Users whose client is being rebuilt
+        self._spreadsheet_lock = threading.Lock()  # Guards the shared spreadsheet cache
+        self._opening: dict[tuple[str, str], threading.Event] = {}  # Spreadsheets being opened; guarded by _spreadsheet_lock
+
+        # Tokens are renewed off the request path so user actions rarely wait on a refresh
+        self._stop_refresh = threading.Event()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name="SheetsTokenRefresh", daemon=True)
+        self._refresh_thread.start()
+
+    def _refresh_loop(self) -> None:
+        """Periodically rebuilds cached clients whose credentials are about to expire."""
+        while not self._stop_refresh.wait(self.REFRESH_INTERVAL_SECONDS):
+            self._evict_idle_clients()
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            for user_id, credentials in list(self._client_credentials.items()):
+                if credentials.expiry is None or (credentials.expiry - now).total_seconds() > self.REFRESH_AHEAD_SECONDS:
+                    continue
+                try:
+                    # get_credentials refreshes and persists the token; the client is rebuilt if it changed
+                    self._authorize_client(user_id)
+                    logger.debug("Background token refresh completed for user {}", user_id)
+                except Exception as e:
+                    logger.warning(f"Background token refresh failed for user {user_id}: {e}")
+
+    def _evict_idle_clients(self) -> None:
+        """Drops clients that haven't been requested within CLIENT_IDLE_SECONDS."""
+        cutoff = time.monotonic() - self.CLIENT_IDLE_SECONDS
+        for user_id, last_used in list(self._last_used.items()):
+            if last_used < cutoff:
+                logger.debug("Evicting idle gspread client for user {}", user_id)
+                self._clear_cache(user_id)
+
+    def _evict_least_recently_used(self) -> None:
+        """Drops the least recently used clients while the cache is over MAX_CACHED_CLIENTS."""
+        while len(self.client_cache) > self.MAX_CACHED_CLIENTS:
+            cached_users = [user_id for user_id in list(self._last_used) if user_id in self.client_cache]
+            if not cached_users:
+                break
+            self._clear_cache(min(cached_users, key=lambda user_id: self._last_used.get(user_id, 0.0)))
+
+    def close(self) -> None:
+        """Stops the background token refresh thread."""
+        self._stop_refresh.set()
 
     def _get_client(self, user_id: str) -> gspread.Client | None:
         """
         Gets an authenticated gspread client from cache or creates a new one for efficiency.
-        Always ensures the client has valid, non-expired credentials.
+        A cached client is returned directly while its credentials are valid for more than
+        CREDENTIALS_EXPIRY_BUFFER_SECONDS; otherwise fresh credentials are fetched (and
+        refreshed if needed) and the client is rebuilt only if the access token changed.
 
         Args:
             user_id: Unique ID of the user.
@@ -43,88 +128,207 @@ class GoogleSheetsClient:
             APIError: If gspread authorization fails.
             Exception: For other unexpected errors.
         """
-        create_new_client = False
-        
-        # Check if we already have a cached client
-        with self._cache_lock:
-            if user_id in self.client_cache:
-                logger.debug(f"Found cached client for user {user_id}, checking if token is valid")
-                try:
-                    # Test the cached client with a simple API call
-                    # This will trigger a token refresh if needed
-                    client = self.client_cache[user_id]
-                    
-                    # We want to force a refresh, so bypass any cached client
-                    # and always get fresh credentials
-                    create_new_client = True
-                except Exception as e:
-                    logger.warning(f"Cached client for user {user_id} failed test: {e}")
-                    create_new_client = True
-            else:
-                create_new_client = True
-
-        if create_new_client:
-            try:
-                # Always get fresh credentials from the oauth manager
-                # This will refresh the token if it's expired
-                credentials = self.oauth_manager.get_credentials(user_id)
-                
-                if not credentials:
-                    logger.warning(f"Authentication failed: No valid credentials for user {user_id}")
-                    self._clear_cache(user_id)
-                    return None
+        self._last_used[user_id] = time.monotonic()
 
-                # Create a new client with the fresh credentials
-                client = gspread.authorize(credentials)
+        # Lock-free fast path: single dict reads are atomic
+        cached_credentials = self._client_credentials.get(user_id)
+        client = self.client_cache.get(user_id)
+        if client is not None and cached_credentials is not None and self._credentials_fresh(cached_credentials):
+            return client
 
-                # Cache the new client
-                with self._cache_lock:
-                    self.client_cache[user_id] = client
+        # Single-flight: only one thread per user rebuilds the client, others wait for it
+        with self._client_lock(user_id):
+            event = self._inflight.get(user_id)
+            is_leader = event is None
+            if is_leader:
+                event = threading.Event()
+                self._inflight[user_id] = event
 
-                logger.info(f"Successfully authenticated and cached new gspread client for user {user_id}")
+        if not is_leader:
+            event.wait(timeout=self.AUTH_WAIT_TIMEOUT_SECONDS)
+            client = self.client_cache.get(user_id)
+            if client is not None:
                 return client
+            # The other attempt failed; authenticate here so errors surface to this caller
+            return self._authorize_client(user_id)
+
+        try:
+            return self._authorize_client(user_id)
+        finally:
+            with self._client_lock(user_id):
+                self._inflight.pop(user_id, None)
+            event.set()
+
+    def _authorize_client(self, user_id: str) -> gspread.Client | None:
+        """
+        Fetches current credentials and builds (or reuses) the user's gspread client.
+
+        Args:
+            user_id: Unique ID of the user.
+
+        Returns:
+            An authenticated gspread.Client or None if no valid credentials exist.
+
+        Raises:
+            GoogleAuthError: If authentication fails during credential retrieval/refresh.
+            APIError: If gspread authorization fails.
+            Exception: For other unexpected errors.
+        """
+        try:
+            # Get fresh credentials from the oauth manager
+            # This will refresh the token if it's expired
+            credentials = self.oauth_manager.get_credentials(user_id)
 
-            except GoogleAuthError as e:
-                logger.error(f"Google authentication error for user {user_id}: {e}")
+            if not credentials:
+                logger.warning(f"Authentication failed: No valid credentials for user {user_id}")
                 self._clear_cache(user_id)
-                
-                # If it's a refresh error, we should clear the token from the database
-                if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
-                    logger.warning(f"Token appears to be revoked or expired for user {user_id}, attempting to clear token")
-                    try:
-                        self.oauth_manager.revoke_token(user_id)
-                    except Exception as revoke_error:
-                        logger.error(f"Failed to revoke invalid token for user {user_id}: {revoke_error}")
-                
-                raise
-                
-            except APIError as e:
-                logger.error(f"gspread API error during authorization for user {user_id}: {e}")
-                
-                # If it's related to auth, clear the cache
-                if "invalid_grant" in str(e).lower() or "unauthorized" in str(e).lower():
-                    self._clear_cache(user_id)
-                
-                raise
-                
-            except Exception as e:
-                logger.exception(f"Unexpected error during authentication for user {user_id}: {e}")
+                return None
+
+            # Reuse the cached client (and its open session) while the token is unchanged
+            with self._client_lock(user_id):
+                client = self.client_cache.get(user_id)
+                cached_credentials = self._client_credentials.get(user_id)
+                if client is not None and cached_credentials is not None and cached_credentials.token == credentials.token:
+                    logger.debug("Reusing cached gspread client for user {}", user_id)
+                    self._client_credentials[user_id] = credentials
+                    return client
+
+            # Create a new client with the fresh credentials
+            client = gspread.authorize(credentials)
+            client.http_client.session.mount("https://", _SHARED_HTTP_ADAPTER)
+
+            # Cache the new client; spreadsheets opened with the previous one are dropped
+            with self._client_lock(user_id):
+                self.client_cache[user_id] = client
+                self._client_credentials[user_id] = credentials
+            self._drop_user_spreadsheets(user_id)
+            self._evict_least_recently_used()
+
+            logger.info(f"Successfully authenticated and cached new gspread client for user {user_id}")
+            return client
+
+        except GoogleAuthError as e:
+            logger.error(f"Google authentication error for user {user_id}: {e}")
+            self._clear_cache(user_id)
+            
+            # If it's a refresh error, we should clear the token from the database
+            if _REVOKED_TOKEN_RE.search(str(e)):
+                logger.warning(f"Token appears to be revoked or expired for user {user_id}, attempting to clear token")
+                try:
+                    self.oauth_manager.revoke_token(user_id)
+                except Exception as revoke_error:
+                    logger.error(f"Failed to revoke invalid token for user {user_id}: {revoke_error}")
+            
+            raise
+            
+        except APIError as e:
+            logger.error(f"gspread API error during authorization for user {user_id}: {e}")
+            
+            # If it's related to auth, clear the cache
+            if _AUTH_API_ERROR_RE.search(str(e)):
                 self._clear_cache(user_id)
-                raise
-        
-        return client
+            
+            raise
+            
+        except Exception as e:
+            logger.exception(f"Unexpected error during authentication for user {user_id}: {e}")
+            self._clear_cache(user_id)
+            raise
+
+    def _client_lock(self, user_id: str) -> threading.Lock:
+        """Returns the lock stripe guarding a user's cached client."""
+        return self._client_locks[hash(user_id) & (self.LOCK_STRIPES - 1)]
+
+    def _credentials_fresh(self, credentials: Credentials) -> bool:
+        """Checks whether credentials stay valid beyond the expiry buffer."""
+        if not credentials.valid or credentials.expiry is None:
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (credentials.expiry - now).total_seconds() > self.CREDENTIALS_EXPIRY_BUFFER_SECONDS
 
     def _clear_cache(self, user_id: str) -> None:
         """Removes a user's client from the cache to prevent stale authentication."""
-        with self._cache_lock:
-            if user_id in self.client_cache:
-                del self.client_cache[user_id]
-                logger.debug(f"Cleared gspread client cache for user {user_id}")
+        with self._client_lock(user_id):
+            self._client_credentials.pop(user_id, None)
+            self._last_used.pop(user_id, None)
+            if self.client_cache.pop(user_id, None) is not None:
+                logger.debug("Cleared gspread client cache for user {}", user_id)
+        self._drop_user_spreadsheets(user_id)
+
+    def _drop_user_spreadsheets(self, user_id: str) -> None:
+        """Removes a user's cached spreadsheets."""
+        with self._spreadsheet_lock:
+            for key in [key for key in self._spreadsheet_cache if key[0] == user_id]:
+                del self._spreadsheet_cache[key]
+
+    def _get_cached_spreadsheet(self, user_id: str, spreadsheet_id: str) -> gspread.Spreadsheet | None:
+        """Returns a cached spreadsheet handle if it has not expired."""
+        key = (user_id, spreadsheet_id)
+        with self._spreadsheet_lock:
+            entry = self._spreadsheet_cache.get(key)
+            if entry is None:
+                return None
+            spreadsheet, cached_at = entry
+            if time.monotonic() - cached_at > self.SPREADSHEET_TTL_SECONDS:
+                del self._spreadsheet_cache[key]
+                return None
+            return spreadsheet
+
+    def _cache_spreadsheet(self, user_id: str, spreadsheet_id: str, spreadsheet: gspread.Spreadsheet) -> None:
+        """Stores a spreadsheet handle, evicting the oldest entry when the cache is full."""
+        key = (user_id, spreadsheet_id)
+        with self._spreadsheet_lock:
+            self._spreadsheet_cache.pop(key, None)
+            # Dicts keep insertion order, so the first key is the oldest entry
+            while len(self._spreadsheet_cache) >= self.MAX_CACHED_SPREADSHEETS:
+                del self._spreadsheet_cache[next(iter(self._spreadsheet_cache))]
+            self._spreadsheet_cache[key] = (spreadsheet, time.monotonic())
+
+    def _open_by_key(self, client: gspread.Client, user_id: str, spreadsheet_id: str) -> gspread.Spreadsheet:
+        """
+        Opens and caches a spreadsheet, letting concurrent callers for the same one share a single request.
+
+        Raises:
+            SpreadsheetNotFound: If the spreadsheet ID is invalid or inaccessible.
+            APIError: For other Google API errors.
+        """
+        key = (user_id, spreadsheet_id)
+        with self._spreadsheet_lock:
+            event = self._opening.get(key)
+            is_leader = event is None
+            if is_leader:
+                event = threading.Event()
+                self._opening[key] = event
+
+        if not is_leader:
+            event.wait(timeout=self.AUTH_WAIT_TIMEOUT_SECONDS)
+            spreadsheet = self._get_cached_spreadsheet(user_id, spreadsheet_id)
+            if spreadsheet is not None:
+                return spreadsheet
+            # The other attempt failed; open here so errors surface to this caller
+            spreadsheet = call_with_retry(client.open_by_key, spreadsheet_id)
+            self._cache_spreadsheet(user_id, spreadsheet_id, spreadsheet)
+            return spreadsheet
+
+        try:
+            spreadsheet = call_with_retry(client.open_by_key, spreadsheet_id)
+            self._cache_spreadsheet(user_id, spreadsheet_id, spreadsheet)
+            return spreadsheet
+        finally:
+            with self._spreadsheet_lock:
+                self._opening.pop(key, None)
+            event.set()
+
+    def invalidate_spreadsheet(self, user_id: str, spreadsheet_id: str) -> None:
+        """Forgets a cached spreadsheet so the next open fetches fresh metadata."""
+        with self._spreadsheet_lock:
+            self._spreadsheet_cache.pop((user_id, spreadsheet_id), None)
 
     def open_spreadsheet(self, user_id: str, spreadsheet_id: str) -> gspread.Spreadsheet | None:
         """
         Opens a spreadsheet by its ID for validated user access control.
-        Handles token refresh and authentication issues.
+        Handles token refresh and authentication issues. Recently opened spreadsheets
+        are served from a short-lived cache once the user's credentials are validated.
 
         Args:
             user_id: Unique ID of the user.
@@ -146,8 +350,13 @@ class GoogleSheetsClient:
                 logger.warning(f"Could not get authenticated client for user {user_id}")
                 return None
 
+            spreadsheet = self._get_cached_spreadsheet(user_id, spreadsheet_id)
+            if spreadsheet is not None:
+                logger.debug("Using cached spreadsheet (ID: {}) for user {}", spreadsheet_id, user_id)
+                return spreadsheet
+
             # Try to open the spreadsheet
-            spreadsheet = client.open_by_key(spreadsheet_id)
+            spreadsheet = self._open_by_key(client, user_id, spreadsheet_id)
             logger.info(f"Opened spreadsheet '{spreadsheet.title}' (ID: {spreadsheet_id}) for user {user_id}")
             return spreadsheet
 
@@ -159,7 +368,7 @@ class GoogleSheetsClient:
             self._clear_cache(user_id)
             
             # If it's a token issue, attempt to revoke and clear the token
-            if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+            if _REVOKED_TOKEN_RE.search(str(e)):
                 try:
                     logger.warning(f"Token expired for user {user_id}, attempting to revoke/clear token")
                     self.oauth_manager.revoke_token(user_id)
@@ -180,7 +389,7 @@ class GoogleSheetsClient:
                 logger.warning(f"Permission denied for spreadsheet {spreadsheet_id}, user {user_id}.")
             
             # Handle authentication-related API errors
-            if "invalid_grant" in str(e).lower() or "unauthorized" in str(e).lower():
+            if _AUTH_API_ERROR_RE.search(str(e)):
                 logger.warning(f"Authentication-related API error for user {user_id}, clearing cache")
                 self._clear_cache(user_id)
                 
@@ -3,16 +3,27 @@ Operations for manipulating Google Sheets data using gspread with OAuth 2.0.
 Interacts with the database to retrieve the user's active spreadsheet.
 """
 
+import threading
+import time
+from concurrent.futures import Future
 from typing import Any
 
 import gspread
+from google.auth.exceptions import GoogleAuthError
 from gspread.exceptions import APIError, WorksheetNotFound
 from loguru import logger
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 
-from ..db.database import SessionLocal, UserSheet
+from ..db.database import ScopedSession, UserSheet
 from .client import GoogleSheetsClient
+from .retry import RATE_LIMIT_STATUS_CODES, call_with_retry
+
+# Built once; only the user_id parameter changes between executions
+_ACTIVE_SPREADSHEET_ID_STMT = select(UserSheet.spreadsheet_id).where(
+    UserSheet.user_id == bindparam("user_id"),
+    UserSheet.is_active == True,  # noqa: E712
+)
 
 
 class MissingHeadersError(Exception):
@@ -38,6 +49,15 @@ class SheetsOperations:
         "income": ["Date", "User", "Category", "Amount", "Timestamp", "Comment"],
     }
 
+    # How long a successful ensure_sheets_exist check is trusted for the same spreadsheet
+    SHEETS_VERIFIED_TTL_SECONDS = 24 * 60 * 60
+
+    # How long append_row trusts a worksheet's header row after reading it; short, since users may edit it
+    HEADERS_VERIFIED_TTL_SECONDS = 5 * 60
+
+    # How long a successful setup_for_user is reused when the same spreadsheet is selected again
+    SETUP_TTL_SECONDS = 10 * 60
+
     def __init__(self, client: GoogleSheetsClient) -> None:
         """
         Initializes operations with a Google Sheets client for authenticated access.
@@ -46,23 +66,134 @@ class SheetsOperations:
             client: Google Sheets client with OAuth support
         """
         self.client = client
+        # Worksheet handles by (user_id, spreadsheet_id) and title, to skip per-call lookups
+        self._worksheet_cache: dict[tuple[str, str], dict[str, gspread.Worksheet]] = {}
+        self._worksheet_lock = threading.Lock()
+        # Last successful internal-sheets check by (user_id, spreadsheet_id); guarded by _worksheet_lock
+        self._sheets_verified_at: dict[tuple[str, str], float] = {}
+        # Active spreadsheet ID per user, to skip the DB lookup on each write; guarded by _worksheet_lock
+        self._active_spreadsheet_ids: dict[str, str] = {}
+        # Last matching header read by (user_id, spreadsheet_id, worksheet id); guarded by _worksheet_lock
+        self._headers_verified_at: dict[tuple[str, str, int], float] = {}
+        # Last successful setup by user_id: (spreadsheet_id, title, time); guarded by _worksheet_lock
+        self._setup_cache: dict[str, tuple[str, str, float]] = {}
+        # Rows waiting to be written, by (user_id, spreadsheet_id, worksheet id), with one flush lock per key.
+        # Worksheet ids are only unique within a spreadsheet, so the spreadsheet is part of the key.
+        self._pending_rows: dict[tuple[str, str, int], list[tuple[list[Any], Future]]] = {}
+        self._flush_locks: dict[tuple[str, str, int], threading.Lock] = {}
+        self._pending_lock = threading.Lock()
+
+    def _cache_worksheets(self, user_id: str, spreadsheet: gspread.Spreadsheet, worksheets: list[gspread.Worksheet]) -> dict[str, gspread.Worksheet]:
+        """Stores the worksheet handles of a spreadsheet, replacing any previous entry."""
+        by_title = {ws.title: ws for ws in worksheets}
+        with self._worksheet_lock:
+            self._worksheet_cache[(user_id, spreadsheet.id)] = by_title
+        return by_title
+
+    def _get_cached_worksheet(self, user_id: str, spreadsheet: gspread.Spreadsheet, sheet_name: str) -> gspread.Worksheet:
+        """
+        Returns a worksheet handle, listing the spreadsheet's worksheets once on a miss.
+
+        Raises:
+            WorksheetNotFound: If the spreadsheet has no worksheet with that name.
+        """
+        with self._worksheet_lock:
+            worksheet = self._worksheet_cache.get((user_id, spreadsheet.id), {}).get(sheet_name)
+        if worksheet is None:
+            worksheet = self._cache_worksheets(user_id, spreadsheet, call_with_retry(spreadsheet.worksheets)).get(sheet_name)
+            if worksheet is None:
+                raise WorksheetNotFound(sheet_name)
+        return worksheet
+
+    def _append_batched(self, user_id: str, worksheet: gspread.Worksheet, values: list[Any]) -> None:
+        """
+        Appends a row, coalescing rows queued concurrently for the same worksheet.
+
+        Rows that arrive while another write to the worksheet is in flight are sent
+        together in a single append_rows call. Every caller still waits for its own
+        row to be written and receives the write's exception if it fails.
+
+        Raises:
+            APIError: If the Sheets API rejects the write.
+        """
+        key = (user_id, worksheet.spreadsheet_id, worksheet.id)
+        future: Future = Future()
+        with self._pending_lock:
+            self._pending_rows.setdefault(key, []).append((values, future))
+            flush_lock = self._flush_locks.setdefault(key, threading.Lock())
+
+        with flush_lock:
+            # A previous flush may already have written this row
+            if not future.done():
+                with self._pending_lock:
+                    batch = self._pending_rows.pop(key, [])
+                try:
+                    # The table always starts at A1 (header row), so the API doesn't have to locate it
+                    call_with_retry(worksheet.append_rows, [row for row, _ in batch], table_range="A1", status_codes=RATE_LIMIT_STATUS_CODES)
+                except Exception as e:
+                    for _, pending in batch:
+                        pending.set_exception(e)
+                else:
+                    for _, pending in batch:
+                        pending.set_result(None)
+                    if len(batch) > 1:
+                        logger.debug("Wrote {} queued rows in one append for user {}", len(batch), user_id)
+                finally:
+                    # Drop the lock once nothing is queued; waiters still holding it find their row written
+                    with self._pending_lock:
+                        if key not in self._pending_rows:
+                            self._flush_locks.pop(key, None)
+
+        future.result()
+
+    def clear_user_cache(self, user_id: str) -> None:
+        """Forgets the user's cached worksheet handles, sheet checks and active spreadsheet."""
+        with self._worksheet_lock:
+            self._active_spreadsheet_ids.pop(user_id, None)
+            self._setup_cache.pop(user_id, None)
+            for key in [key for key in self._worksheet_cache if key[0] == user_id]:
+                del self._worksheet_cache[key]
+            for key in [key for key in self._sheets_verified_at if key[0] == user_id]:
+                del self._sheets_verified_at[key]
+            for key in [key for key in self._headers_verified_at if key[0] == user_id]:
+                del self._headers_verified_at[key]
 
     def _get_active_spreadsheet_id(self, db: Session, user_id: str) -> str | None:
         """Retrieves active spreadsheet ID from database for persistence."""
-        stmt = select(UserSheet.spreadsheet_id).where(
-            UserSheet.user_id == user_id,
-            UserSheet.is_active == True,  # noqa: E712
-        )
-        spreadsheet_id = db.scalars(stmt).first()
+        # user_id is the table's primary key, so there is at most one row
+        spreadsheet_id = db.scalar(_ACTIVE_SPREADSHEET_ID_STMT, {"user_id": user_id})
         if not spreadsheet_id:
             logger.warning(f"No active spreadsheet found in DB for user {user_id}")
             return None
         return spreadsheet_id
 
+    def invalidate_active_spreadsheet(self, user_id: str) -> None:
+        """Forgets the cached active spreadsheet ID so the next lookup reads it from the DB."""
+        with self._worksheet_lock:
+            self._active_spreadsheet_ids.pop(user_id, None)
+
+    def _get_cached_active_spreadsheet_id(self, user_id: str) -> str | None:
+        """Returns the user's active spreadsheet ID, querying the DB only on a cache miss."""
+        with self._worksheet_lock:
+            spreadsheet_id = self._active_spreadsheet_ids.get(user_id)
+        if spreadsheet_id:
+            return spreadsheet_id
+
+        # The worker thread's session is reused across lookups; close() just returns its connection
+        db = ScopedSession()
+        try:
+            spreadsheet_id = self._get_active_spreadsheet_id(db, user_id)
+        finally:
+            db.close()
+        if spreadsheet_id:
+            with self._worksheet_lock:
+                self._active_spreadsheet_ids[user_id] = spreadsheet_id
+        return spreadsheet_id
+
     def setup_for_user(self, user_id: str, spreadsheet_id: str) -> str | None:
         """
         Verifies spreadsheet access and prepares internal sheets.
-        Doesn't store references in memory for statelessness.
+        Selecting the same spreadsheet again within SETUP_TTL_SECONDS reuses the previous result.
         Active sheet is saved in the DB through the /sheet command handler.
 
         Args:
@@ -75,12 +206,21 @@ class SheetsOperations:
         Raises:
             Exception: If operation fails (propagated from client or ensure_sheets_exist)
         """
+        with self._worksheet_lock:
+            cached = self._setup_cache.get(user_id)
+        if cached and cached[0] == spreadsheet_id and time.monotonic() - cached[2] < self.SETUP_TTL_SECONDS:
+            logger.debug("Spreadsheet {} was set up recently for user {}, skipping verification", spreadsheet_id, user_id)
+            return cached[1]
+
         try:
-            if not self.client.is_authenticated(user_id):
-                logger.warning(f"User {user_id} not authenticated for setup_for_user")
+            # Setup must verify current access, so skip any cached handle.
+            # open_spreadsheet authenticates the user itself, so no separate check is needed.
+            self.client.invalidate_spreadsheet(user_id, spreadsheet_id)
+            try:
+                spreadsheet = self.client.open_spreadsheet(user_id, spreadsheet_id)
+            except GoogleAuthError as e:
+                logger.warning(f"User {user_id} not authenticated for setup_for_user: {e}")
                 return None
-
-            spreadsheet = self.client.open_spreadsheet(user_id, spreadsheet_id)
             if not spreadsheet:
                 logger.error(f"Failed to open spreadsheet {spreadsheet_id} for user {user_id} during setup.")
                 return None
@@ -89,9 +229,13 @@ class SheetsOperations:
 
             self.ensure_sheets_exist(user_id, spreadsheet)
 
+            with self._worksheet_lock:
+                self._setup_cache[user_id] = (spreadsheet_id, spreadsheet.title, time.monotonic())
             return spreadsheet.title
 
         except Exception as e:
+            with self._worksheet_lock:
+                self._setup_cache.pop(user_id, None)
             logger.error(f"Error setting up spreadsheet {spreadsheet_id} for user {user_id}: {e}")
             raise
 
@@ -111,37 +255,84 @@ class SheetsOperations:
         if not spreadsheet:
             raise ValueError("Spreadsheet object cannot be None for ensure_sheets_exist")
 
-        logger.debug(f"Ensuring internal sheets exist in '{spreadsheet.title}' for user {user_id}")
+        verified_key = (user_id, spreadsheet.id)
+        with self._worksheet_lock:
+            verified_at = self._sheets_verified_at.get(verified_key)
+        if verified_at is not None and time.monotonic() - verified_at < self.SHEETS_VERIFIED_TTL_SECONDS:
+            logger.debug("Internal sheets already verified in '{}' for user {}", spreadsheet.title, user_id)
+            return
+
+        logger.debug("Ensuring internal sheets exist in '{}' for user {}", spreadsheet.title, user_id)
 
-        required_sheets = self.REQUIRED_SHEETS
         try:
-            existing_sheets = [ws.title for ws in spreadsheet.worksheets()]
-
-            for sheet_name, headers in required_sheets.items():
-                if sheet_name not in existing_sheets:
-                    # Create the worksheet if it doesn't exist
-                    worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1, cols=len(headers))
-                    logger.info(f"Internal sheet '{sheet_name}' created in '{spreadsheet.title}' for user {user_id}. Adding headers...")
-                    # Use the append_row method with the spreadsheet parameter
-                    if not self.append_row(user_id, sheet_name, headers, spreadsheet=spreadsheet):
-                        logger.error(f"Failed to add headers to newly created sheet '{sheet_name}' for user {user_id}")
-                else:
-                    # Get the worksheet directly from the spreadsheet object
-                    try:
-                        worksheet = spreadsheet.worksheet(sheet_name)
-                        actual_headers = worksheet.row_values(1)
-                        if not actual_headers:
-                            logger.info(f"Headers missing in internal sheet '{sheet_name}'. Adding headers...")
-                            # Use the append_row method with the spreadsheet parameter
-                            if not self.append_row(user_id, sheet_name, headers, spreadsheet=spreadsheet):
-                                logger.error(f"Failed to add headers to existing empty sheet '{sheet_name}' for user {user_id}")
-                        elif actual_headers != headers:
-                            logger.warning(
-                                f"Headers in existing internal sheet '{sheet_name}' do not match expected for user {user_id} in '{spreadsheet.title}'. "
-                                "Not modifying existing headers."
-                            )
-                    except Exception as e:
-                        logger.error(f"Failed to retrieve existing worksheet '{sheet_name}' for header check for user {user_id}: {e}")
+            # One listing call both checks existence and refreshes the worksheet cache
+            existing_sheets = self._cache_worksheets(user_id, spreadsheet, call_with_retry(spreadsheet.worksheets))
+
+            missing = [name for name in self.REQUIRED_SHEETS if name not in existing_sheets]
+            present = [name for name in self.REQUIRED_SHEETS if name in existing_sheets]
+
+            # Headers of all existing internal sheets in a single values.batchGet
+            needs_headers = []
+            if present:
+                response = call_with_retry(spreadsheet.values_batch_get, [f"'{name}'!1:1" for name in present])
+                for sheet_name, value_range in zip(present, response.get("valueRanges", [])):
+                    rows = value_range.get("values", [])
+                    actual_headers = rows[0] if rows else []
+                    if not actual_headers:
+                        logger.info(f"Headers missing in internal sheet '{sheet_name}'. Adding headers...")
+                        needs_headers.append(sheet_name)
+                    elif actual_headers != self.REQUIRED_SHEETS[sheet_name]:
+                        logger.warning(
+                            f"Headers in existing internal sheet '{sheet_name}' do not match expected for user {user_id} in '{spreadsheet.title}'. "
+                            "Not modifying existing headers."
+                        )
+
+            # Missing sheets and their headers are created atomically in one batchUpdate;
+            # sheet IDs are assigned up front so updateCells can target the new sheets
+            if missing:
+                next_sheet_id = max((ws.id for ws in existing_sheets.values()), default=0) + 1
+                requests: list[dict[str, Any]] = []
+                for sheet_id, sheet_name in enumerate(missing, start=next_sheet_id):
+                    headers = self.REQUIRED_SHEETS[sheet_name]
+                    requests.append(
+                        {
+                            "addSheet": {
+                                "properties": {
+                                    "sheetId": sheet_id,
+                                    "title": sheet_name,
+                                    "gridProperties": {"rowCount": 1, "columnCount": len(headers)},
+                                }
+                            }
+                        }
+                    )
+                    requests.append(
+                        {
+                            "updateCells": {
+                                "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+                                "rows": [{"values": [{"userEnteredValue": {"stringValue": header}} for header in headers]}],
+                                "fields": "userEnteredValue",
+                            }
+                        }
+                    )
+                # Only rate limiting is retried: a failed response may follow an applied addSheet
+                call_with_retry(spreadsheet.batch_update, {"requests": requests}, status_codes=RATE_LIMIT_STATUS_CODES)
+                logger.info(f"Internal sheets {missing} created with headers in '{spreadsheet.title}' for user {user_id}.")
+                # New worksheet handles are loaded on next use
+                with self._worksheet_lock:
+                    self._worksheet_cache.pop((user_id, spreadsheet.id), None)
+
+            # Headers for existing empty sheets are written with one values.batchUpdate
+            if needs_headers:
+                call_with_retry(
+                    spreadsheet.values_batch_update,
+                    {
+                        "valueInputOption": "RAW",
+                        "data": [{"range": f"'{name}'!A1", "values": [self.REQUIRED_SHEETS[name]]} for name in needs_headers],
+                    }
+                )
+
+            with self._worksheet_lock:
+                self._sheets_verified_at[verified_key] = time.monotonic()
         except APIError as e:
             logger.error(f"API error ensuring internal sheets exist for user {user_id} in '{spreadsheet.title}': {e}")
             raise
@@ -166,13 +357,11 @@ class SheetsOperations:
             APIError: If there are issues with the Sheets API.
             Exception: For other unexpected errors.
         """
-        db: Session | None = None
         try:
             if not self.client.is_authenticated(user_id):
                 raise RuntimeError(f"User {user_id} is not authenticated.")
 
-            db = SessionLocal()
-            spreadsheet_id = self._get_active_spreadsheet_id(db, user_id)
+            spreadsheet_id = self._get_cached_active_spreadsheet_id(user_id)
             if not spreadsheet_id:
                 return None
 
@@ -181,8 +370,8 @@ class SheetsOperations:
                 logger.error(f"Failed to open active spreadsheet {spreadsheet_id} for user {user_id} in get_worksheet.")
                 return None
 
-            worksheet = spreadsheet.worksheet(sheet_name)
-            logger.debug(f"Retrieved worksheet '{sheet_name}' from spreadsheet '{spreadsheet.title}' for user {user_id}")
+            worksheet = self._get_cached_worksheet(user_id, spreadsheet, sheet_name)
+            logger.debug("Retrieved worksheet '{}' from spreadsheet '{}' for user {}", sheet_name, spreadsheet.title, user_id)
             return worksheet
 
         except WorksheetNotFound:
@@ -197,9 +386,6 @@ class SheetsOperations:
         except Exception as e:
             logger.exception(f"Unexpected error getting worksheet '{sheet_name}' for user {user_id}: {e}")
             raise
-        finally:
-            if db:
-                db.close()
 
     def append_row(self, user_id: str, sheet_name: str, values: list[Any], spreadsheet: gspread.Spreadsheet | None = None) -> bool:
         """
@@ -226,8 +412,8 @@ class SheetsOperations:
             if spreadsheet:
                 # Use the provided spreadsheet directly
                 try:
-                    worksheet = spreadsheet.worksheet(sheet_name)
-                    logger.debug(f"Using provided spreadsheet to access worksheet '{sheet_name}' for user {user_id}")
+                    worksheet = self._get_cached_worksheet(user_id, spreadsheet, sheet_name)
+                    logger.debug("Using provided spreadsheet to access worksheet '{}' for user {}", sheet_name, user_id)
                 except WorksheetNotFound:
                     logger.error(f"Worksheet '{sheet_name}' not found in provided spreadsheet for user {user_id}")
                     return False
@@ -242,26 +428,34 @@ class SheetsOperations:
             if not expected_headers:
                 raise ValueError(f"No expected headers defined for sheet name: {sheet_name}")
 
-            try:
-                actual_headers = worksheet.row_values(1)
-            except APIError as api_err:
-                logger.error(f"API error fetching headers for sheet '{sheet_name}', user {user_id}: {api_err}")
-                raise
-            except Exception as head_err:
-                logger.error(f"Error fetching headers for sheet '{sheet_name}', user {user_id}: {head_err}")
-                raise MissingHeadersError(sheet_name, expected_headers, None) from head_err
-
-            # Special case: If we're trying to add headers to an empty sheet, allow it
-            if not actual_headers and values == expected_headers:
-                logger.info(f"Adding headers to empty sheet '{sheet_name}' for user {user_id}")
-            elif not actual_headers or actual_headers != expected_headers:
-                logger.warning(
-                    f"Header mismatch for user {user_id} in sheet '{sheet_name}'. "
-                    f"Expected: {expected_headers}, Found: {actual_headers}. Aborting append."
-                )
-                raise MissingHeadersError(sheet_name, expected_headers, actual_headers)
+            # A recent matching read of the header row saves one API call per append
+            headers_key = (user_id, worksheet.spreadsheet_id, worksheet.id)
+            with self._worksheet_lock:
+                headers_verified_at = self._headers_verified_at.get(headers_key)
+            if headers_verified_at is None or time.monotonic() - headers_verified_at >= self.HEADERS_VERIFIED_TTL_SECONDS:
+                try:
+                    actual_headers = call_with_retry(worksheet.row_values, 1)
+                except APIError as api_err:
+                    logger.error(f"API error fetching headers for sheet '{sheet_name}', user {user_id}: {api_err}")
+                    raise
+                except Exception as head_err:
+                    logger.error(f"Error fetching headers for sheet '{sheet_name}', user {user_id}: {head_err}")
+                    raise MissingHeadersError(sheet_name, expected_headers, None) from head_err
+
+                # Special case: If we're trying to add headers to an empty sheet, allow it
+                if not actual_headers and values == expected_headers:
+                    logger.info(f"Adding headers to empty sheet '{sheet_name}' for user {user_id}")
+                elif not actual_headers or actual_headers != expected_headers:
+                    logger.warning(
+                        f"Header mismatch for user {user_id} in sheet '{sheet_name}'. "
+                        f"Expected: {expected_headers}, Found: {actual_headers}. Aborting append."
+                    )
+                    raise MissingHeadersError(sheet_name, expected_headers, actual_headers)
+                else:
+                    with self._worksheet_lock:
+                        self._headers_verified_at[headers_key] = time.monotonic()
 
-            worksheet.append_row(values)
+            self._append_batched(user_id, worksheet, values)
             logger.info(f"Data appended to sheet '{sheet_name}' for user {user_id} after header validation.")
             return True
 
@@ -269,6 +463,14 @@ class SheetsOperations:
             raise
         except (RuntimeError, APIError, WorksheetNotFound) as e:
             logger.error(f"Error during append operation for user {user_id}, sheet '{sheet_name}': {e}")
+            # The cached spreadsheet may have been deleted or unshared; reopen it next time
+            if isinstance(e, APIError):
+                with self._worksheet_lock:
+                    spreadsheet_id = spreadsheet.id if spreadsheet else self._active_spreadsheet_ids.get(user_id)
+                if spreadsheet_id:
+                    self.client.invalidate_spreadsheet(user_id, spreadsheet_id)
+            # A cached handle may point to a deleted or renamed worksheet
+            self.clear_user_cache(user_id)
             raise
         except Exception as e:
             logger.exception(f"Unexpected error appending row to sheet '{sheet_name}' for user {user_id}: {e}")
@@ -0,0 +1,72 @@
+"""
+Retry helpers for transient Google Sheets API errors.
+"""
+
+import functools
+import random
+import time
+from collections.abc import Callable
+from typing import Any
+
+from gspread.exceptions import APIError
+from loguru import logger
+
+# Rate limiting and transient server errors; anything else is raised immediately
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Only rate limiting is safe to retry for writes that aren't idempotent (e.g. appends):
+# a 5xx may arrive after the write was applied
+RATE_LIMIT_STATUS_CODES = frozenset({429})
+
+
+def _status_code(error: APIError) -> int | None:
+    """Returns the HTTP status code of an API error, if available."""
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def retry_api(max_attempts: int = 5, base_delay: float = 0.5, status_codes: frozenset[int] = RETRYABLE_STATUS_CODES) -> Callable:
+    """
+    Retries a Sheets API call with exponential backoff on 429/5xx errors.
+
+    Args:
+        max_attempts: Total number of attempts, including the first call.
+        base_delay: Delay in seconds before the first retry; doubled on each attempt.
+        status_codes: HTTP status codes that trigger a retry.
+
+    Returns:
+        Decorator wrapping the function with retries.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except APIError as e:
+                    status_code = _status_code(e)
+                    if attempt == max_attempts - 1 or status_code not in status_codes:
+                        raise
+                    delay = base_delay * 2**attempt + random.random() * 0.2
+                    logger.warning(f"Sheets API error {status_code}, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_attempts})")
+                    time.sleep(delay)
+
+        return wrapper
+
+    return decorator
+
+
+def call_with_retry(func: Callable, *args: Any, status_codes: frozenset[int] = RETRYABLE_STATUS_CODES, **kwargs: Any) -> Any:
+    """
+    Calls a Sheets API function with the default backoff policy.
+
+    Args:
+        func: Bound gspread method or other callable to invoke.
+        *args: Positional arguments for the call.
+        status_codes: HTTP status codes that trigger a retry.
+        **kwargs: Keyword arguments for the call.
+
+    Returns:
+        The call's return value.
+    """
+    return retry_api(status_codes=status_codes)(func)(*args, **kwargs)
@@ -3,6 +3,7 @@ Module for managing configuration and environment variables.
 """
 
 import os
+from functools import cache, cached_property
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -12,6 +13,7 @@ from loguru import logger
 class Config:
     """
     Manages project configuration and environment variables.
+    Values are read from the environment on first access and then kept for the process lifetime.
     """
 
     def __init__(self, env_file: str | Path | None = None) -> None:
@@ -30,14 +32,22 @@ class Config:
         Args:
             env_file: Path to .env file (optional)
         """
-        if env_file and os.path.exists(env_file):
+        if env_file and Path(env_file).is_file():
             load_dotenv(env_file)
-            logger.info(f"Environment variables loaded from {env_file}")
+            logger.info("Environment variables loaded from {}", env_file)
         else:
             load_dotenv()
             logger.info("Environment variables loaded (default file)")
 
-    @property
+    def clear_cache(self) -> None:
+        """
+        Forgets cached values so the next access reads the environment again.
+        """
+        for name, attribute in vars(type(self)).items():
+            if isinstance(attribute, cached_property):
+                self.__dict__.pop(name, None)
+
+    @cached_property
     def telegram_token(self) -> str:
         """
         Gets Telegram token from environment variables for API authentication.
@@ -53,7 +63,7 @@ class Config:
             raise ValueError("TELEGRAM_TOKEN not found in environment variables")
         return token
 
-    @property
+    @cached_property
     def oauth_credentials_path(self) -> str:
         """
         Gets the path to OAuth credentials file for Google API access.
@@ -69,7 +79,7 @@ class Config:
             raise ValueError("OAUTH_CREDENTIALS_PATH not found in environment variables")
         return path
 
-    @property
+    @cached_property
     def oauth_server_host(self) -> str:
         """
         Gets host for OAuth server for authentication flow.
@@ -79,7 +89,7 @@ class Config:
         """
         return os.getenv("OAUTH_SERVER_HOST", "localhost")
 
-    @property
+    @cached_property
     def oauth_server_port(self) -> int:
         """
         Gets port for OAuth server for authentication flow.
@@ -93,7 +103,7 @@ class Config:
             logger.warning("Invalid OAuth port in environment variables, using 8000")
             return 8000
 
-    @property
+    @cached_property
     def oauth_redirect_uri(self) -> str:
         """
         Gets OAuth redirect URI for completing authentication flow.
@@ -106,7 +116,7 @@ class Config:
         default_uri = f"http://{self.oauth_server_host}:{self.oauth_server_port}/oauth2callback"
         return os.getenv("OAUTH_REDIRECT_URI", default_uri)
 
-    @property
+    @cached_property
     def oauth_encryption_key(self) -> bytes:
         """
         Gets encryption key for OAuth tokens to ensure secure storage.
@@ -125,7 +135,7 @@ class Config:
             )
         return key.encode()
 
-    @property
+    @cached_property
     def database_url(self) -> str:
         """
         Gets database connection URL for data persistence.
@@ -141,7 +151,7 @@ class Config:
             raise ValueError("DATABASE_URL not found in environment variables")
         return url
 
-    @property
+    @cached_property
     def log_level(self) -> str:
         """
         Gets the logging level from environment variables.
@@ -150,3 +160,17 @@ class Config:
             Logging level string (e.g., "INFO", "DEBUG")
         """
         return os.getenv("LOG_LEVEL", "INFO")
+
+
+@cache
+def get_config(env_file: str | Path | None = None) -> Config:
+    """
+    Returns the process-wide configuration, loading the .env file only once.
+
+    Args:
+        env_file: Path to .env file (optional)
+
+    Returns:
+        Shared Config instance for that env file
+    """
+    return Config(env_file)
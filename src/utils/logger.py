@@ -19,7 +19,8 @@ def setup_logging(log_file: str | Path | None = None, level: str = "INFO") -> No
     logger.remove()
     log_format = "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
 
-    logger.add(sys.stdout, format=log_format, level=level, colorize=True)
+    # ANSI colors only help on a terminal; redirected output (files, journald) stays plain
+    logger.add(sys.stdout, format=log_format, level=level, colorize=sys.stdout.isatty())
 
     if log_file:
         if isinstance(log_file, str):
@@ -33,9 +34,11 @@ def setup_logging(log_file: str | Path | None = None, level: str = "INFO") -> No
             rotation="100 MB",
             retention="1 month",
             compression="zip",
+            # Writes, rotation and compression run in loguru's writer thread, not the caller's
+            enqueue=True,
         )
 
-        logger.info(f"Logging configured. Saving logs to: {log_file}")
+        logger.info("Logging configured. Saving logs to: {}", log_file)
     else:
         logger.info("Logging configured. Console output only.")
 
@@ -10,6 +10,7 @@ import unittest
 from unittest.mock import MagicMock, patch
 
 import pytest
+from cryptography.fernet import Fernet
 from google.auth.exceptions import RefreshError
 from google.oauth2.credentials import Credentials
 
@@ -20,18 +21,28 @@ from src.sheets.client import GoogleSheetsClient
 class TestTokenRefresh(unittest.TestCase):
     """Test suite for token refresh functionality."""
 
-    def setUp(self):
-        """Set up test fixtures."""
+    @classmethod
+    def setUpClass(cls):
+        """Write the dummy client secrets file once for the whole class."""
         # Create a temporary test directory if it doesn't exist
         os.makedirs("tests/temp", exist_ok=True)
         # Create a dummy client secrets file
         with open("tests/temp/test_client_secrets.json", "w") as f:
             f.write('{"web": {"client_id": "test_id", "client_secret": "test_secret"}}')
 
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up test fixtures."""
+        # Remove test files
+        if os.path.exists("tests/temp/test_client_secrets.json"):
+            os.remove("tests/temp/test_client_secrets.json")
+
+    def setUp(self):
+        """Set up test fixtures."""
         self.oauth_manager = OAuthManager(
             client_secrets_file="tests/temp/test_client_secrets.json",
             redirect_uri="http://localhost:8000/callback",
-            encryption_key=b"test_encryption_key_must_be_32_bytes_!"
+            encryption_key=Fernet.generate_key()
         )
         
         # Mock methods to avoid external dependencies
@@ -40,12 +51,6 @@ class TestTokenRefresh(unittest.TestCase):
         self.oauth_manager.save_token = MagicMock()
         self.oauth_manager.revoke_token = MagicMock()
 
-    def tearDown(self):
-        """Clean up test fixtures."""
-        # Remove test files
-        if os.path.exists("tests/temp/test_client_secrets.json"):
-            os.remove("tests/temp/test_client_secrets.json")
-
     def test_token_refresh_when_expired(self):
         """Test that tokens are refreshed when they expire."""
         # Create expired token data
@@ -60,24 +65,12 @@ class TestTokenRefresh(unittest.TestCase):
         }
         
         # Mock credentials refresh
-        with patch("google.oauth2.credentials.Credentials.refresh") as mock_refresh:
-            def side_effect(request):
-                # Update credentials when refresh is called
-                credentials = Credentials(
-                    token="new_token",
-                    refresh_token="test_refresh_token",
-                    token_uri="https://oauth2.googleapis.com/token",
-                    client_id="test_client_id",
-                    client_secret="test_secret",
-                    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-                )
-                # Set an expiry time in the future
-                credentials.expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
-                # Replace the mocked credentials with the updated ones
-                type(mock_refresh.return_value).token = "new_token"
-                type(mock_refresh.return_value).expiry = credentials.expiry
-                return credentials
-                
+        with patch.object(Credentials, "refresh", autospec=True) as mock_refresh:
+            def side_effect(credentials, request):
+                # Update the credentials in place, as a real refresh against the token endpoint does
+                credentials.token = "new_token"
+                credentials.expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+
             mock_refresh.side_effect = side_effect
             
             # Get credentials - this should trigger a refresh
@@ -137,24 +130,12 @@ class TestTokenRefresh(unittest.TestCase):
         }
         
         # Mock credentials refresh
-        with patch("google.oauth2.credentials.Credentials.refresh") as mock_refresh:
-            def side_effect(request):
-                # Update credentials when refresh is called
-                credentials = Credentials(
-                    token="new_token",
-                    refresh_token="test_refresh_token",
-                    token_uri="https://oauth2.googleapis.com/token",
-                    client_id="test_client_id",
-                    client_secret="test_secret",
-                    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-                )
-                # Set an expiry time further in the future
-                credentials.expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
-                # Replace the mocked credentials with the updated ones
-                type(mock_refresh.return_value).token = "new_token"
-                type(mock_refresh.return_value).expiry = credentials.expiry
-                return credentials
-                
+        with patch.object(Credentials, "refresh", autospec=True) as mock_refresh:
+            def side_effect(credentials, request):
+                # Update the credentials in place, as a real refresh against the token endpoint does
+                credentials.token = "new_token"
+                credentials.expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+
             mock_refresh.side_effect = side_effect
             
             # Get credentials - this should trigger a refresh since token expires soon
@@ -172,6 +153,79 @@ class TestTokenRefresh(unittest.TestCase):
             self.assertFalse(credentials.expired)
 
 
+    def test_stored_token_reused_without_refresh(self):
+        """Test that a stored token with a distant expiry is used as-is (e.g. after a restart)."""
+        expiry_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=30)
+        self.oauth_manager.load_token.return_value = {
+            "token": "stored_token",
+            "refresh_token": "test_refresh_token",
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "client_id": "test_client_id",
+            "scopes": ["https://www.googleapis.com/auth/spreadsheets"],
+            "expiry": expiry_time.isoformat()
+        }
+
+        with patch("google.oauth2.credentials.Credentials.refresh") as mock_refresh:
+            credentials = self.oauth_manager.get_credentials("test_user")
+
+            # No call to the token endpoint and nothing re-saved
+            mock_refresh.assert_not_called()
+            self.oauth_manager.save_token.assert_not_called()
+
+            self.assertEqual(credentials.token, "stored_token")
+            self.assertEqual(credentials.expiry, expiry_time.replace(tzinfo=None))
+
+    def test_is_authenticated_reuses_recent_result(self):
+        """Test that repeated is_authenticated calls load the token only once."""
+        self.oauth_manager.get_credentials = MagicMock(return_value=MagicMock(valid=True))
+
+        self.assertTrue(self.oauth_manager.is_authenticated("test_user"))
+        self.assertTrue(self.oauth_manager.is_authenticated("test_user"))
+
+        self.oauth_manager.get_credentials.assert_called_once_with("test_user")
+
+    def test_revoke_token_clears_cached_auth_status(self):
+        """Test that revoking a token drops the cached is_authenticated result."""
+        self.oauth_manager.get_credentials = MagicMock(return_value=MagicMock(valid=True))
+        self.assertTrue(self.oauth_manager.is_authenticated("test_user"))
+
+        with patch("src.auth.oauth.requests.post"), patch("src.auth.oauth.SessionLocal"):
+            OAuthManager.revoke_token(self.oauth_manager, "test_user", token_to_revoke="test_refresh_token")
+
+        self.oauth_manager.get_credentials.return_value = None
+        self.assertFalse(self.oauth_manager.is_authenticated("test_user"))
+        self.assertEqual(self.oauth_manager.get_credentials.call_count, 2)
+
+    def test_deleting_invalid_token_clears_cached_auth_status(self):
+        """Test that deleting a corrupted token entry drops the cached is_authenticated result."""
+        self.oauth_manager.get_credentials = MagicMock(return_value=MagicMock(valid=True))
+        self.assertTrue(self.oauth_manager.is_authenticated("test_user"))
+
+        with patch("src.auth.oauth.SessionLocal"):
+            self.oauth_manager._delete_invalid_token_entry("test_user")
+
+        self.oauth_manager.get_credentials.return_value = None
+        self.assertFalse(self.oauth_manager.is_authenticated("test_user"))
+        self.assertEqual(self.oauth_manager.get_credentials.call_count, 2)
+
+    def test_is_authenticated_does_not_cache_result_overlapping_revoke(self):
+        """Test that a check which loaded the token before a concurrent revoke doesn't cache the stale result."""
+        stored_credentials = MagicMock(valid=True)
+
+        def get_credentials(user_id):
+            # The token is revoked after this check loaded it but before the result is cached
+            with patch("src.auth.oauth.requests.post"), patch("src.auth.oauth.SessionLocal"):
+                OAuthManager.revoke_token(self.oauth_manager, user_id, token_to_revoke="test_refresh_token")
+            return stored_credentials
+
+        self.oauth_manager.get_credentials = MagicMock(side_effect=get_credentials)
+        self.assertTrue(self.oauth_manager.is_authenticated("test_user"))
+
+        self.oauth_manager.get_credentials = MagicMock(return_value=None)
+        self.assertFalse(self.oauth_manager.is_authenticated("test_user"))
+        self.oauth_manager.get_credentials.assert_called_once_with("test_user")
+
+
 class TestGoogleSheetsClientToken(unittest.TestCase):
     """Test suite for GoogleSheetsClient token handling."""
     
@@ -212,6 +266,55 @@ class TestGoogleSheetsClientToken(unittest.TestCase):
             
             # Verify result is the new client
             self.assertEqual(result, mock_authorize.return_value)
+
+    def test_get_client_reuses_cached_client_when_token_unchanged(self):
+        """Test that _get_client reuses the cached client while the access token is the same."""
+        mock_credentials = MagicMock()
+        mock_credentials.token = "same_token"
+        self.oauth_manager.get_credentials.return_value = mock_credentials
+
+        cached_client = MagicMock()
+        self.client.client_cache["test_user"] = cached_client
+        # No expiry known, so credentials are re-checked before reuse
+        self.client._client_credentials["test_user"] = MagicMock(token="same_token", expiry=None)
+
+        with patch("gspread.authorize") as mock_authorize:
+            result = self.client._get_client("test_user")
+
+            # Credentials are still checked, but no new client is built
+            self.oauth_manager.get_credentials.assert_called_once_with("test_user")
+            mock_authorize.assert_not_called()
+            self.assertIs(result, cached_client)
+
+    def test_get_client_skips_credential_fetch_when_cached_credentials_fresh(self):
+        """Test that _get_client returns the cached client without contacting the OAuth manager."""
+        cached_credentials = Credentials(token="cached_token")
+        cached_credentials.expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+
+        cached_client = MagicMock()
+        self.client.client_cache["test_user"] = cached_client
+        self.client._client_credentials["test_user"] = cached_credentials
+
+        result = self.client._get_client("test_user")
+
+        self.oauth_manager.get_credentials.assert_not_called()
+        self.assertIs(result, cached_client)
+
+    def test_open_spreadsheet_reuses_cached_spreadsheet(self):
+        """Test that open_spreadsheet only fetches the spreadsheet once within the TTL."""
+        mock_client = MagicMock()
+        self.client._get_client = MagicMock(return_value=mock_client)
+
+        first = self.client.open_spreadsheet("test_user", "sheet_id")
+        second = self.client.open_spreadsheet("test_user", "sheet_id")
+
+        mock_client.open_by_key.assert_called_once_with("sheet_id")
+        self.assertIs(first, second)
+
+        # Invalidation forces a new fetch
+        self.client.invalidate_spreadsheet("test_user", "sheet_id")
+        self.client.open_spreadsheet("test_user", "sheet_id")
+        self.assertEqual(mock_client.open_by_key.call_count, 2)
             
     def test_is_authenticated_checks_credentials(self):
         """Test that is_authenticated attempts to get a client to check credentials."""
@@ -40,7 +40,7 @@ def mock_message(mocker, mock_chat):
 
 
 @pytest.fixture
-def mock_update(mock_user, mock_message):
+def mock_update(mocker, mock_user, mock_message):
     """Fixture para crear un mock de Update de Telegram."""
     mock = mocker.Mock(spec=Update)
     mock.update_id = 98765
@@ -4,13 +4,30 @@ Tests para el módulo del bot de Telegram.
 
 import pytest
 from telegram import BotCommand, Update, User
-from telegram.ext import Application, ApplicationBuilder, CommandHandler
 
 from src.bot.bot import TelegramBot
 from src.bot.commands import get_commands
 from src.bot.handlers import error_handler, help_command, start_command
 
 
+@pytest.fixture
+def patched_application_builder(mocker):
+    """Replaces ApplicationBuilder with a mock that builds a mock Application."""
+    # Create mock objects; only the awaited methods need to be AsyncMocks
+    mock_app = mocker.Mock()
+    mock_app.bot.set_my_commands = mocker.AsyncMock()
+    mock_app.run_polling = mocker.AsyncMock()
+
+    # Create a mock for ApplicationBuilder
+    mock_builder = mocker.Mock()
+    mock_builder.token.return_value = mock_builder
+    mock_builder.build.return_value = mock_app
+
+    # Use mocker to replace ApplicationBuilder
+    mocker.patch("telegram.ext.ApplicationBuilder", return_value=mock_builder)
+    return mock_builder, mock_app
+
+
 def test_get_commands():
     """Verifica que la lista de comandos no está vacía y contiene los comandos básicos."""
     commands = get_commands()
@@ -40,25 +57,11 @@ async def test_bot_initialization():
 
 
 @pytest.mark.asyncio
-async def test_bot_setup(mocker):
+async def test_bot_setup(patched_application_builder):
     """Test bot configuration."""
     # Arrange
     token = "test_token_123"
-
-    # Create mock objects
-    mock_app = mocker.Mock()
-    mock_app.add_handler = mocker.Mock()
-    mock_app.add_error_handler = mocker.Mock()
-    mock_app.bot = mocker.Mock()
-    mock_app.bot.set_my_commands = mocker.AsyncMock()
-
-    # Create a mock for ApplicationBuilder
-    mock_builder = mocker.Mock()
-    mock_builder.token.return_value = mock_builder
-    mock_builder.build.return_value = mock_app
-
-    # Use mocker to replace ApplicationBuilder
-    mocker.patch("telegram.ext.ApplicationBuilder", return_value=mock_builder)
+    mock_builder, mock_app = patched_application_builder
 
     # Act
     bot = TelegramBot(token)
@@ -90,26 +93,11 @@ async def test_bot_run_without_setup():
 
 
 @pytest.mark.asyncio
-async def test_bot_run(mocker):
+async def test_bot_run(patched_application_builder):
     """Test bot execution."""
     # Arrange
     token = "test_token_123"
-
-    # Create mock objects
-    mock_app = mocker.Mock()
-    mock_app.add_handler = mocker.Mock()
-    mock_app.add_error_handler = mocker.Mock()
-    mock_app.bot = mocker.Mock()
-    mock_app.bot.set_my_commands = mocker.AsyncMock()
-    mock_app.run_polling = mocker.AsyncMock()
-
-    # Create a mock for ApplicationBuilder
-    mock_builder = mocker.Mock()
-    mock_builder.token.return_value = mock_builder
-    mock_builder.build.return_value = mock_app
-
-    # Use mocker to replace ApplicationBuilder
-    mocker.patch("telegram.ext.ApplicationBuilder", return_value=mock_builder)
+    _, mock_app = patched_application_builder
 
     # Act
     bot = TelegramBot(token)
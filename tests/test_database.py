@@ -0,0 +1,74 @@
+"""
+Tests for the database schema migrations.
+"""
+
+import datetime
+
+from sqlalchemy import create_engine, inspect, select, text
+
+from src.db.database import Base, UserCategories, _migrate_user_categories
+
+# user_categories as created before user_id became the primary key
+LEGACY_USER_CATEGORIES_DDL = [
+    """
+    CREATE TABLE user_categories (
+        id INTEGER NOT NULL,
+        user_id VARCHAR,
+        categories_json TEXT NOT NULL,
+        created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        updated_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id)
+    )
+    """,
+    "CREATE INDEX ix_user_categories_id ON user_categories (id)",
+    "CREATE INDEX ix_user_categories_user_id ON user_categories (user_id)",
+]
+
+
+def test_migrate_user_categories_from_legacy_schema():
+    """Test that a legacy user_categories table is rebuilt keyed by user_id, keeping each user's latest row."""
+    # Arrange
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        Base.metadata.tables["users"].create(connection)
+        for statement in LEGACY_USER_CATEGORIES_DDL:
+            connection.execute(text(statement))
+        connection.execute(
+            text("INSERT INTO user_categories (id, user_id, categories_json, updated_at) VALUES (:id, :user_id, :categories_json, :updated_at)"),
+            [
+                {"id": 1, "user_id": "1", "categories_json": '{"old": []}', "updated_at": "2024-01-01 00:00:00.000000"},
+                {"id": 2, "user_id": "1", "categories_json": '{"new": []}', "updated_at": "2024-02-01 00:00:00.000000"},
+                {"id": 3, "user_id": "2", "categories_json": '{"only": []}', "updated_at": "2024-01-15 00:00:00.000000"},
+            ],
+        )
+
+    # Act
+    with engine.begin() as connection:
+        _migrate_user_categories(connection)
+
+    # Assert
+    inspector = inspect(engine)
+    assert inspector.get_pk_constraint("user_categories")["constrained_columns"] == ["user_id"]
+    assert inspector.get_indexes("user_categories") == []
+    with engine.connect() as connection:
+        rows = connection.execute(select(UserCategories.user_id, UserCategories.categories_json, UserCategories.updated_at).order_by(UserCategories.user_id)).all()
+    assert [(row.user_id, row.categories_json) for row in rows] == [("1", '{"new": []}'), ("2", '{"only": []}')]
+    assert rows[0].updated_at == datetime.datetime(2024, 2, 1)
+
+
+def test_migrate_user_categories_skips_current_schema():
+    """Test that an up-to-date user_categories table is left untouched."""
+    # Arrange
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(UserCategories.__table__.insert(), {"user_id": "1", "categories_json": "{}"})
+
+    # Act
+    with engine.begin() as connection:
+        _migrate_user_categories(connection)
+
+    # Assert
+    with engine.connect() as connection:
+        assert connection.execute(select(UserCategories.categories_json)).scalars().all() == ["{}"]
@@ -2,10 +2,15 @@
 Tests para el módulo de Google Sheets.
 """
 
+import threading
+import time
+
 import pytest
+from gspread.exceptions import APIError
 
 from src.sheets.client import GoogleSheetsClient
 from src.sheets.operations import SheetsOperations
+from src.sheets.retry import call_with_retry
 
 
 def test_client_authentication(mocker):
@@ -174,23 +179,220 @@ def test_ensure_sheets_exist(mocker):
     # Arrange
     mock_client = mocker.Mock()
     mock_spreadsheet = mocker.Mock()
-    mock_worksheet = mocker.Mock()
+    mock_spreadsheet.id = "fake_spreadsheet_id"
 
-    mock_client.open_spreadsheet.return_value = mock_spreadsheet
     # Simulate that the sheets do not exist initially
     mock_spreadsheet.worksheets.return_value = []
-    mock_spreadsheet.add_worksheet.return_value = mock_worksheet
 
-    operations = SheetsOperations(mock_client, "fake_spreadsheet_id")
+    operations = SheetsOperations(mock_client)
+
+    # Act
+    operations.ensure_sheets_exist("user", mock_spreadsheet)
+
+    # Assert
+    # Both sheets and their headers are created in a single batchUpdate
+    mock_spreadsheet.batch_update.assert_called_once()
+    requests = mock_spreadsheet.batch_update.call_args.args[0]["requests"]
+    added = [r["addSheet"]["properties"] for r in requests if "addSheet" in r]
+    assert [p["title"] for p in added] == ["expenses", "income"]
+    headers = {
+        r["updateCells"]["start"]["sheetId"]: [c["userEnteredValue"]["stringValue"] for c in r["updateCells"]["rows"][0]["values"]]
+        for r in requests
+        if "updateCells" in r
+    }
+    assert headers == {p["sheetId"]: SheetsOperations.REQUIRED_SHEETS[p["title"]] for p in added}
+    # No separate header write or per-sheet header reads
+    mock_spreadsheet.values_batch_update.assert_not_called()
+    mock_spreadsheet.values_batch_get.assert_not_called()
+
+
+def test_retry_api_retries_rate_limit_errors(mocker):
+    """Test that 429 errors are retried until the call succeeds."""
+    # Arrange
+    mocker.patch("src.sheets.retry.time.sleep")
+    error = APIError.__new__(APIError)
+    error.response = mocker.Mock(status_code=429)
+    api_call = mocker.Mock(side_effect=[error, error, "ok"])
+
+    # Act
+    result = call_with_retry(api_call, "arg")
+
+    # Assert
+    assert result == "ok"
+    assert api_call.call_count == 3
+
+
+def test_retry_api_does_not_retry_client_errors(mocker):
+    """Test that non-retryable errors are raised on the first attempt."""
+    # Arrange
+    sleep = mocker.patch("src.sheets.retry.time.sleep")
+    error = APIError.__new__(APIError)
+    error.response = mocker.Mock(status_code=400)
+    api_call = mocker.Mock(side_effect=error)
+
+    # Act & Assert
+    with pytest.raises(APIError):
+        call_with_retry(api_call)
+    assert api_call.call_count == 1
+    sleep.assert_not_called()
+
+
+def test_append_rows_coalesced_while_write_in_flight(mocker):
+    """Test that rows queued during an in-flight write are sent together in the next call."""
+    # Arrange
+    operations = SheetsOperations(mocker.Mock())
+    worksheet = mocker.Mock()
+    worksheet.spreadsheet_id = "spreadsheet"
+    worksheet.id = 1
+    first_write_started = threading.Event()
+    release_first_write = threading.Event()
+
+    def append_rows(rows, **kwargs):
+        if not first_write_started.is_set():
+            first_write_started.set()
+            release_first_write.wait(timeout=5)
+
+    worksheet.append_rows.side_effect = append_rows
 
     # Act
-    operations.spreadsheet = mock_spreadsheet
-    operations.ensure_sheets_exist()
+    first = threading.Thread(target=operations._append_batched, args=("user", worksheet, ["row 1"]))
+    first.start()
+    first_write_started.wait(timeout=5)
+    queued = [threading.Thread(target=operations._append_batched, args=("user", worksheet, [f"row {i}"])) for i in (2, 3)]
+    for thread in queued:
+        thread.start()
+    while len(operations._pending_rows.get(("user", "spreadsheet", 1), [])) < 2:
+        time.sleep(0.01)
+    release_first_write.set()
+    for thread in [first, *queued]:
+        thread.join(timeout=5)
 
     # Assert
-    # Verify that the two necessary sheets are created
-    assert mock_spreadsheet.add_worksheet.call_count == 2
-    expected_calls = [mocker.call(title="gastos", rows=1, cols=5), mocker.call(title="ingresos", rows=1, cols=5)]
-    assert mock_spreadsheet.add_worksheet.call_args_list == expected_calls
-    # Verify that headers are added
-    assert mock_worksheet.append_row.call_count == 2
+    assert worksheet.append_rows.call_count == 2
+    assert worksheet.append_rows.call_args_list[0].args[0] == [["row 1"]]
+    assert sorted(worksheet.append_rows.call_args_list[1].args[0]) == [["row 2"], ["row 3"]]
+    # Flush locks are dropped once the queue has drained
+    assert operations._flush_locks == {}
+
+
+def test_append_rows_not_coalesced_across_spreadsheets(mocker):
+    """Test that rows for same-id worksheets in different spreadsheets are written to their own worksheet."""
+    # Arrange
+    operations = SheetsOperations(mocker.Mock())
+    worksheet_a = mocker.Mock(spreadsheet_id="spreadsheet_a", id=0)
+    worksheet_b = mocker.Mock(spreadsheet_id="spreadsheet_b", id=0)
+    first_write_started = threading.Event()
+    release_first_write = threading.Event()
+
+    def append_rows(rows, **kwargs):
+        if not first_write_started.is_set():
+            first_write_started.set()
+            release_first_write.wait(timeout=5)
+
+    worksheet_a.append_rows.side_effect = append_rows
+
+    # Act
+    first = threading.Thread(target=operations._append_batched, args=("user", worksheet_a, ["first A"]))
+    first.start()
+    first_write_started.wait(timeout=5)
+    second = threading.Thread(target=operations._append_batched, args=("user", worksheet_a, ["second A"]))
+    second.start()
+    while not operations._pending_rows:
+        time.sleep(0.01)
+    operations._append_batched("user", worksheet_b, ["for B"])
+    release_first_write.set()
+    for thread in (first, second):
+        thread.join(timeout=5)
+
+    # Assert
+    assert [call.args[0] for call in worksheet_a.append_rows.call_args_list] == [[["first A"]], [["second A"]]]
+    worksheet_b.append_rows.assert_called_once()
+    assert worksheet_b.append_rows.call_args.args[0] == [["for B"]]
+
+
+def test_active_spreadsheet_id_cached_until_invalidated(mocker):
+    """Test that the active spreadsheet ID is read from the DB once until invalidated."""
+    # Arrange
+    mocker.patch("src.sheets.operations.ScopedSession")
+    operations = SheetsOperations(mocker.Mock())
+    lookup = mocker.patch.object(operations, "_get_active_spreadsheet_id", return_value="sheet_id")
+
+    # Act
+    first = operations._get_cached_active_spreadsheet_id("user")
+    second = operations._get_cached_active_spreadsheet_id("user")
+    operations.invalidate_active_spreadsheet("user")
+    third = operations._get_cached_active_spreadsheet_id("user")
+
+    # Assert
+    assert first == second == third == "sheet_id"
+    assert lookup.call_count == 2
+
+
+def test_append_row_reuses_recent_header_check(mocker):
+    """Test that consecutive appends read the header row only once."""
+    # Arrange
+    operations = SheetsOperations(mocker.Mock())
+    worksheet = mocker.Mock()
+    worksheet.id = 1
+    worksheet.row_values.return_value = SheetsOperations.REQUIRED_SHEETS["income"]
+    mocker.patch.object(operations, "get_worksheet", return_value=worksheet)
+
+    # Act
+    operations.append_row("user", "income", ["2024-01-01", "user", "Salary", 1000, "ts", ""])
+    operations.append_row("user", "income", ["2024-01-02", "user", "Salary", 500, "ts", ""])
+
+    # Assert
+    worksheet.row_values.assert_called_once_with(1)
+    assert worksheet.append_rows.call_count == 2
+
+
+def test_append_row_checks_headers_of_new_spreadsheet(mocker):
+    """Test that a header check on one spreadsheet isn't reused for a same-id worksheet in another."""
+    # Arrange
+    operations = SheetsOperations(mocker.Mock())
+    old_worksheet = mocker.Mock(spreadsheet_id="old_spreadsheet", id=0)
+    new_worksheet = mocker.Mock(spreadsheet_id="new_spreadsheet", id=0)
+    for worksheet in (old_worksheet, new_worksheet):
+        worksheet.row_values.return_value = SheetsOperations.REQUIRED_SHEETS["income"]
+    mocker.patch.object(operations, "get_worksheet", side_effect=[old_worksheet, new_worksheet])
+
+    # Act
+    operations.append_row("user", "income", ["2024-01-01", "user", "Salary", 1000, "ts", ""])
+    operations.append_row("user", "income", ["2024-01-02", "user", "Salary", 500, "ts", ""])
+
+    # Assert
+    old_worksheet.row_values.assert_called_once_with(1)
+    new_worksheet.row_values.assert_called_once_with(1)
+
+
+def test_setup_for_user_reuses_recent_setup(mocker):
+    """Test that selecting the same spreadsheet again skips the API calls."""
+    # Arrange
+    mock_client = mocker.Mock()
+    mock_client.open_spreadsheet.return_value.title = "Finances"
+    operations = SheetsOperations(mock_client)
+    ensure = mocker.patch.object(operations, "ensure_sheets_exist")
+
+    # Act
+    first = operations.setup_for_user("user", "sheet_id")
+    second = operations.setup_for_user("user", "sheet_id")
+
+    # Assert
+    assert first == second == "Finances"
+    mock_client.open_spreadsheet.assert_called_once_with("user", "sheet_id")
+    ensure.assert_called_once()
+
+
+def test_append_row_api_error_invalidates_cached_spreadsheet(mocker):
+    """Test that an API error on append drops the client's cached spreadsheet."""
+    # Arrange
+    mock_client = mocker.Mock()
+    operations = SheetsOperations(mock_client)
+    operations._active_spreadsheet_ids["user"] = "sheet_id"
+    mocker.patch.object(operations, "get_worksheet", side_effect=APIError(mocker.Mock()))
+
+    # Act & Assert
+    with pytest.raises(APIError):
+        operations.append_row("user", "income", ["2024-01-01", "user", "Salary", 1000, "ts", ""])
+    mock_client.invalidate_spreadsheet.assert_called_once_with("user", "sheet_id")
+    assert "user" not in operations._active_spreadsheet_ids